@@ -5,27 +5,49 @@
 
 import concurrent.futures
 import argparse
+import atexit
+import collections
+import configparser
+import contextlib
 import copy
 import inspect
+import json
 import logging
+import logging.handlers
+import mmap
 import functools
+import hashlib
+import importlib
+import importlib.util
 import multiprocessing
 import os
 import pathlib
+import queue
 import re
+import shlex
+import shutil
+import sqlite3
+import struct
+import tempfile
+import threading
+import time
+import urllib.parse
 
 import yaml
 from git import repo
 
 import subprocess
 import platform
+import sys
 
 
-def run_command(command):
+def run_command(command, cwd=None, timeout=None):
     """
     执行一个命令行脚本，并返回其输出和返回值。
 
     :param command: 要执行的命令行脚本，可以是字符串或列表。
+    :param cwd: 执行目录, None 为当前目录
+    :param timeout: 超时秒数, 超时后杀掉进程并返回 -1, None 为不超时
     :return: (stdout, stderr, returncode) - 标准输出，标准错误，返回值
     """
     # 如果 command 是字符串，拆分成列表
@@ -34,13 +56,20 @@ def run_command(command):
     # 检查当前操作系统
     # 如果是 Windows 系统，使用 shell=True
     if platform.system() == "Windows":
-        process = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        process = subprocess.Popen(command, shell=True, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                   text=True)
     else:
         # 对于其他系统（如 Linux），使用 shell=False
-        process = subprocess.Popen(command, shell=False, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        process = subprocess.Popen(command, shell=False, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                   text=True)
 
     # 获取标准输出和标准错误
-    stdout, stderr = process.communicate()
+    try:
+        stdout, stderr = process.communicate(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        stdout, stderr = process.communicate()
+        return -1, stdout, f"{stderr}\ntimed out after {timeout}s: {' '.join(command)}"
 
     # 获取返回值
     returncode = process.returncode
@@ -48,27 +77,196 @@ def run_command(command):
     return returncode, stdout, stderr
 
 
+def low_priority_prefix():
+    """
+    command prefix to run background work with idle io / low cpu priority, empty if not supported
+    """
+    if platform.system() != "Linux":
+        return []
+    prefix = []
+    if shutil.which("ionice"):
+        prefix += ["ionice", "-c", "3"]
+    if shutil.which("nice"):
+        prefix += ["nice", "-n", "19"]
+    return prefix
+
+
+def remote_host(remote: str) -> str:
+    """
+    get host of a git remote url, supports url style and scp style(git@host:path), local path is "local"
+    """
+    if "://" in remote:
+        parsed = urllib.parse.urlsplit(remote)
+        if parsed.scheme == "file":
+            return "local"
+        return parsed.hostname or "local"
+    # scp style: [user@]host:path, but not windows drive like c:/xxx
+    match = re.match(r"^(?:[^@/]+@)?([^:/]+):(?!//)", remote)
+    if match and len(match.group(1)) > 1:
+        return match.group(1)
+    return "local"
+
+
+def parse_ssh_remote(remote: str):
+    """
+    get (user, host, port) of an ssh remote, url style(ssh://, git+ssh://) or scp style(user@host:path)
+    :return: None if not an ssh remote
+    """
+    if "://" in remote:
+        parsed = urllib.parse.urlsplit(remote)
+        if parsed.scheme not in ("ssh", "git+ssh", "ssh+git") or not parsed.hostname:
+            return None
+        return parsed.username, parsed.hostname, parsed.port
+    match = re.match(r"^(?:([^@/]+)@)?([^:/]+):(?!//)", remote)
+    if match and len(match.group(2)) > 1:
+        return match.group(1), match.group(2), None
+    return None
+
+
+class HostLimiter:
+    """
+    limit concurrent tasks to the same remote host
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.semaphores = {}
+
+    def slot(self, host: str, limit: int):
+        with self.lock:
+            sem = self.semaphores.get(host, None)
+            if sem is None:
+                sem = threading.BoundedSemaphore(limit)
+                self.semaphores[host] = sem
+        return sem
+
+
+host_limiter = HostLimiter()
+
+
 # ---------- logger ----------
 
 
+class ProgressStreamHandler(logging.StreamHandler):
+    """
+    clear live progress line and write each log record under the progress lock,
+    the render thread can not redraw in between so they do not mix
+    """
+
+    def emit(self, record):
+        progress = runner.progress
+        if progress is None:
+            super().emit(record)
+            return
+        with progress.lock:
+            progress.clear_line_locked()
+            super().emit(record)
+
+
+# repo the current worker thread is running, added to log records
+log_context = threading.local()
+
+
+class RepoContextFilter(logging.Filter):
+    def filter(self, record):
+        record.repo = getattr(log_context, "repo", None)
+        return True
+
+
+class RepoFileHandler(logging.Handler):
+    """
+    write all records into <run_dir>/run.log and each repo's records into <run_dir>/<repo>.log
+    only called in the log listener thread, files kept open until exit
+    """
+
+    def __init__(self):
+        super().__init__(logging.DEBUG)
+        self.setFormatter(logging.Formatter("%(asctime)s|%(levelname)s|%(threadName)s|%(message)s"))
+        self.run_dir = None
+        self.files = {}
+
+    def start(self, run_dir: pathlib.Path):
+        run_dir.mkdir(parents=True, exist_ok=True)
+        self.acquire()
+        try:
+            self.run_dir = run_dir
+        finally:
+            self.release()
+
+    def file_of(self, name: str):
+        f = self.files.get(name, None)
+        if f is None:
+            f = open(self.run_dir / f"{name}.log", "a", encoding="utf-8")
+            self.files[name] = f
+        return f
+
+    def emit(self, record):
+        if self.run_dir is None:
+            return
+        try:
+            msg = self.format(record) + "\n"
+            self.file_of("run").write(msg)
+            if record.repo:
+                self.file_of(record.repo.replace("/", "__")).write(msg)
+        except Exception:
+            self.handleError(record)
+
+    def close(self):
+        self.acquire()
+        try:
+            for f in self.files.values():
+                f.close()
+            self.files.clear()
+        finally:
+            self.release()
+        super().close()
+
+
 def create_cli_log(tag: str, format_str: str):
+    """
+    records are put into a queue and written by a listener thread, workers never block on terminal or file io
+    :return: logger, cli handler, per repo file handler
+    """
     # create logger
     tmp_log = logging.getLogger(tag)
+    tmp_log.setLevel(LOG_LEVEL)
     # create cli handle
-    logger_handle = logging.StreamHandler()
+    logger_handle = ProgressStreamHandler()
     logger_handle.setLevel(LOG_LEVEL)
     # set formatter
     formatter = logging.Formatter(format_str)
     logger_handle.setFormatter(formatter)
+    repo_handle = RepoFileHandler()
     # add handle
-    tmp_log.addHandler(logger_handle)
-    return tmp_log
+    log_queue = queue.SimpleQueue()
+    queue_handle = logging.handlers.QueueHandler(log_queue)
+    queue_handle.addFilter(RepoContextFilter())
+    tmp_log.addHandler(queue_handle)
+    listener = logging.handlers.QueueListener(log_queue, logger_handle, repo_handle, respect_handler_level=True)
+    listener.start()
+
+    def stop_listener():
+        listener.stop()
+        repo_handle.close()
+
+    atexit.register(stop_listener)
+    return tmp_log, logger_handle, repo_handle
+
+
+def set_verbose(verbose: bool, log_files: bool):
+    """
+    -v prints debug logs; per repo log files also get debug logs, cli keeps its own level
+    """
+    if verbose:
+        cli_log_handle.setLevel(logging.DEBUG)
+    if verbose or log_files:
+        cmd_logger.setLevel(logging.DEBUG)
 
 
 LOG_LEVEL = logging.INFO
 logging.basicConfig(level=LOG_LEVEL)
 logging.getLogger().handlers.clear()
-cmd_logger = create_cli_log("cmd", '%(message)s')
+cmd_logger, cli_log_handle, repo_log_handle = create_cli_log("cmd", '%(message)s')
 # logger = create_cli_log("main", '|%(asctime)s|%(name)s|%(levelname)s|%(message)s')
 logger = cmd_logger
 
@@ -81,19 +279,483 @@ def find_file_in_parent_dir(start_path, file_name: str):
     path = start_path
     assert path.is_dir()
     while True:
-        logger.debug(f"find {path} {file_name}")
+        logger.debug("find %s %s", path, file_name)
         f = path / file_name
         if f.exists() and f.is_file():
             result = start_path.relative_to(path)
-            logger.debug(f"success find at {path} {result}")
+            logger.debug("success find at %s %s", path, result)
             return result, path
         if path.parent == path:
-            logger.debug(f"end find {path}")
+            logger.debug("end find %s", path)
             break
         path = path.parent.absolute()
     return None, None
 
 
+# ---------- git dir helpers, read files directly to avoid starting git ----------
+def resolve_git_dir(path):
+    """
+    get .git dir of a work tree, supports .git file(submodule/worktree), None if not a git repo
+    """
+    dot_git = pathlib.Path(path) / ".git"
+    if dot_git.is_dir():
+        return dot_git
+    if dot_git.is_file():
+        with open(dot_git) as f:
+            content = f.read().strip()
+        if content.startswith("gitdir:"):
+            git_dir = pathlib.Path(content[len("gitdir:"):].strip())
+            if not git_dir.is_absolute():
+                git_dir = pathlib.Path(path) / git_dir
+            return git_dir.resolve()
+    return None
+
+
+def common_git_dir(git_dir):
+    """
+    worktree's git dir shares config/objects/refs with main repo by commondir file
+    """
+    git_dir = pathlib.Path(git_dir)
+    commondir = git_dir / "commondir"
+    if commondir.is_file():
+        with open(commondir) as f:
+            common = pathlib.Path(f.read().strip())
+        if not common.is_absolute():
+            common = git_dir / common
+        return common.resolve()
+    return git_dir
+
+
+def is_worktree(path) -> bool:
+    """
+    linked worktree made by git worktree add, not a main repo or submodule
+    """
+    git_dir = resolve_git_dir(path)
+    return git_dir is not None and common_git_dir(git_dir) != git_dir
+
+
+def read_git_remote_url(path, remote_name="origin"):
+    """
+    read remote url from repo's config file, None if not found
+    """
+    git_dir = resolve_git_dir(path)
+    if git_dir is None:
+        return None
+    parser = configparser.ConfigParser(strict=False, interpolation=None)
+    try:
+        parser.read(common_git_dir(git_dir) / "config")
+    except configparser.Error:
+        return None
+    section = f'remote "{remote_name}"'
+    if not parser.has_section(section):
+        return None
+    return parser.get(section, "url", fallback=None)
+
+
+def normalize_remote(remote: str) -> str:
+    """
+    a/b.git, a/b.git/ and a/b are the same remote
+    """
+    remote = remote.strip().rstrip("/")
+    if remote.endswith(".git"):
+        remote = remote[:-len(".git")]
+    return remote
+
+
+def scan_git_repos(base_path, max_depth: int, exclude=()):
+    """
+    find git repos under base_path, not into repos, hidden dirs and exclude dirs
+    :return: {relative posix path: origin url or None}
+    """
+    base_path = pathlib.Path(base_path)
+    exclude = {str(pathlib.Path(p)) for p in exclude}
+    found = {}
+    stack = [(base_path, 0)]
+    while stack:
+        path, depth = stack.pop()
+        if depth >= max_depth:
+            continue
+        try:
+            children = list(os.scandir(path))
+        except OSError:
+            continue
+        for entry in children:
+            if not entry.is_dir(follow_symlinks=False) or entry.name.startswith("."):
+                continue
+            child = pathlib.Path(entry.path)
+            if str(child) in exclude:
+                continue
+            if (child / ".git").exists():
+                found[child.relative_to(base_path).as_posix()] = read_git_remote_url(child)
+            else:
+                stack.append((child, depth + 1))
+    return found
+
+
+def read_head_branch(path):
+    """
+    current branch name by reading HEAD file, "HEAD" if detached, None if not a git repo
+    """
+    git_dir = resolve_git_dir(path)
+    if git_dir is None:
+        return None
+    try:
+        with open(git_dir / "HEAD") as f:
+            head = f.read().strip()
+    except OSError:
+        return None
+    if head.startswith("ref: refs/heads/"):
+        return head[len("ref: refs/heads/"):]
+    return "HEAD"
+
+
+def read_ref_sha(git_dir, ref: str):
+    """
+    sha of a ref from loose ref file or packed-refs, None if not found
+    """
+    common = common_git_dir(git_dir)
+    for ref_dir in (pathlib.Path(git_dir), common):
+        ref_file = ref_dir / ref
+        if ref_file.is_file():
+            with open(ref_file) as f:
+                return f.read().strip()
+    packed_refs = common / "packed-refs"
+    if packed_refs.is_file():
+        with open(packed_refs) as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 2 and parts[1] == ref:
+                    return parts[0]
+    return None
+
+
+def read_head_sha(path):
+    """
+    HEAD commit sha by reading files, None if not a git repo or no commit yet
+    """
+    git_dir = resolve_git_dir(path)
+    if git_dir is None:
+        return None
+    try:
+        with open(git_dir / "HEAD") as f:
+            head = f.read().strip()
+    except OSError:
+        return None
+    if head.startswith("ref: "):
+        return read_ref_sha(git_dir, head[len("ref: "):])
+    return head
+
+
+def read_submodule_shas(path, prefix: str = "") -> dict:
+    """
+    checked out sha of each submodule(recursive) by reading files, {path: sha}
+    """
+    gitmodules = pathlib.Path(path) / ".gitmodules"
+    if not gitmodules.is_file():
+        return {}
+    parser = configparser.ConfigParser(strict=False, interpolation=None)
+    try:
+        parser.read(gitmodules)
+    except configparser.Error:
+        return {}
+    shas = {}
+    for section in parser.sections():
+        sub_path = parser.get(section, "path", fallback=None)
+        if sub_path is None:
+            continue
+        sha = read_head_sha(pathlib.Path(path) / sub_path)
+        if sha is None:
+            # not initialized
+            continue
+        shas[prefix + sub_path] = sha
+        shas.update(read_submodule_shas(pathlib.Path(path) / sub_path, f"{prefix}{sub_path}/"))
+    return shas
+
+
+def read_repo_state(path, need_status: bool) -> dict:
+    """
+    state used by --where, one git status call at most
+    :return: {"branch", "dirty", "ahead", "behind"}, None if not a git repo
+    """
+    branch = read_head_branch(path)
+    if branch is None:
+        return None
+    state = {"branch": branch, "dirty": False, "ahead": 0, "behind": 0}
+    if not need_status:
+        return state
+    # same as GitPython's is_dirty(), untracked files not count
+    ret, stdout, _ = run_command(["git", "status", "--porcelain=v2", "--branch", "--untracked-files=no"], cwd=path)
+    if ret != 0:
+        return None
+    for line in stdout.splitlines():
+        if line.startswith("# branch.ab "):
+            ahead, behind = line.split()[2:4]
+            state["ahead"] = int(ahead)
+            state["behind"] = -int(behind)
+        elif not line.startswith("#"):
+            state["dirty"] = True
+    return state
+
+
+def worktree_fingerprint(path, untracked: bool = False) -> str:
+    """
+    fingerprint of uncommitted changes in tracked files, "" if clean
+    status gives changed paths, their size and mtime catch edits of already changed files
+    :param untracked: also untracked files not ignored
+    """
+    ret, stdout, _ = run_command(["git", "status", "--porcelain", "-z",
+                                  "--untracked-files=all" if untracked else "--untracked-files=no"], cwd=path)
+    if ret != 0:
+        return None
+    if stdout == "":
+        return ""
+    digest = hashlib.sha1(stdout.encode())
+    entries = iter(stdout.split("\0"))
+    for entry in entries:
+        if len(entry) < 4:
+            continue
+        if entry[0] in "RC" or entry[1] in "RC":
+            # rename/copy is followed by its source path without status
+            next(entries, None)
+        try:
+            st = os.lstat(pathlib.Path(path) / entry[3:])
+            digest.update(f"{st.st_size}:{st.st_mtime_ns}".encode())
+        except OSError:
+            pass
+    return digest.hexdigest()
+
+
+WHERE_FLAGS = ("dirty", "clean", "ahead", "behind")
+
+
+def parse_where(exprs) -> list:
+    """
+    parse --where: dirty, clean, ahead, behind, branch=xxx, branch!=xxx
+    :return: [(key, op, value)]
+    """
+    predicates = []
+    for expr in exprs or []:
+        expr = expr.strip()
+        match = re.fullmatch(r"branch\s*(!=|=)\s*(\S+)", expr)
+        if match:
+            predicates.append(("branch", match.group(1), match.group(2)))
+        elif expr in WHERE_FLAGS:
+            predicates.append((expr, "", None))
+        else:
+            raise ValueError(f"unknown --where {expr}, supported: {', '.join(WHERE_FLAGS)}, branch=x, branch!=x")
+    return predicates
+
+
+def where_arg(expr: str) -> str:
+    """
+    argparse type of --where, so a bad predicate is a usage error
+    """
+    try:
+        parse_where([expr])
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+    return expr
+
+
+def match_where(state, predicates) -> bool:
+    if state is None:
+        return False
+    for key, op, value in predicates:
+        if key == "branch":
+            if (state["branch"] == value) != (op == "="):
+                return False
+        elif key == "clean":
+            if state["dirty"]:
+                return False
+        elif not state[key]:
+            return False
+    return True
+
+
+def dir_size(path) -> int:
+    """
+    total bytes of files under path
+    """
+    total = 0
+    if path is None:
+        return total
+    for root, dirs, files in os.walk(path):
+        for file in files:
+            try:
+                total += os.lstat(os.path.join(root, file)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def load_json(path, default):
+    """
+    load json file under .repm, default if not exists or broken
+    """
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+
+def save_json(path, data):
+    path = pathlib.Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "w") as f:
+        json.dump(data, f, indent=1)
+    os.replace(tmp, path)
+
+
+class ResultCache:
+    """
+    json results stored in files named by key, size bounded, least recently used are removed first
+    """
+
+    def __init__(self, path, max_bytes: int):
+        self.path = pathlib.Path(path)
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def key(*parts) -> str:
+        return hashlib.sha256("\0".join(str(part) for part in parts).encode()).hexdigest()
+
+    def get(self, key: str):
+        file = self.path / f"{key}.json"
+        data = load_json(file, None)
+        if data is not None:
+            # mtime is the last used time for lru
+            os.utime(file)
+        return data
+
+    def put(self, key: str, data):
+        save_json(self.path / f"{key}.json", data)
+
+    def evict(self):
+        if not self.path.is_dir():
+            return 0
+        files = []
+        for file in self.path.glob("*.json"):
+            try:
+                st = file.stat()
+            except OSError:
+                continue
+            files.append((st.st_mtime, st.st_size, file))
+        total = sum(size for _, size, _ in files)
+        evicted = 0
+        for mtime, size, file in sorted(files):
+            if total <= self.max_bytes:
+                break
+            file.unlink()
+            total -= size
+            evicted += 1
+        return evicted
+
+
+# ---------- repo stats, run in process pool ----------
+PACK_OBJECT_TYPES = {1: "commit", 2: "tree", 3: "blob", 4: "tag", 6: "delta", 7: "delta"}
+LANGUAGE_EXTENSIONS = {
+    ".c": "C", ".h": "C/C++ Header", ".cpp": "C++", ".cc": "C++", ".cxx": "C++", ".hpp": "C/C++ Header",
+    ".java": "Java", ".kt": "Kotlin", ".rs": "Rust", ".go": "Go", ".py": "Python", ".lua": "Lua",
+    ".js": "JavaScript", ".ts": "TypeScript", ".vue": "Vue", ".cs": "C#", ".rb": "Ruby", ".php": "PHP",
+    ".sh": "Shell", ".cmake": "CMake", ".html": "HTML", ".css": "CSS", ".md": "Markdown",
+    ".json": "JSON", ".yaml": "YAML", ".yml": "YAML", ".xml": "XML", ".proto": "Protobuf", ".sql": "SQL",
+}
+
+
+def read_pack_objects(idx_path):
+    """
+    read a v2 pack index and the pack headers by mmap, no git process
+    :return: [(offset, sha, type, size, packed size)], size is inflated size, delta's size is the delta's
+    """
+    pack_path = pathlib.Path(idx_path).with_suffix(".pack")
+    if not pack_path.is_file() or os.path.getsize(idx_path) < 8 + 256 * 4:
+        return []
+    with open(idx_path, "rb") as idx_file, mmap.mmap(idx_file.fileno(), 0, access=mmap.ACCESS_READ) as idx:
+        if idx[:4] != b"\xfftOc" or struct.unpack(">I", idx[4:8])[0] != 2:
+            return []
+        fanout_end = 8 + 256 * 4
+        count = struct.unpack(">I", idx[fanout_end - 4:fanout_end])[0]
+        sha_start = fanout_end
+        offset_start = sha_start + 24 * count
+        large_start = offset_start + 4 * count
+        offsets = list(struct.unpack(f">{count}I", idx[offset_start:offset_start + 4 * count]))
+        for i, offset in enumerate(offsets):
+            if offset & 0x80000000:
+                pos = large_start + 8 * (offset & 0x7fffffff)
+                offsets[i] = struct.unpack(">Q", idx[pos:pos + 8])[0]
+        shas = [idx[sha_start + 20 * i:sha_start + 20 * i + 20].hex() for i in range(count)]
+    objects = []
+    pack_size = os.path.getsize(pack_path)
+    if pack_size == 0:
+        return []
+    with open(pack_path, "rb") as pack_file, mmap.mmap(pack_file.fileno(), 0, access=mmap.ACCESS_READ) as pack:
+        order = sorted(range(count), key=lambda x: offsets[x])
+        for n, i in enumerate(order):
+            offset = offsets[i]
+            end = offsets[order[n + 1]] if n + 1 < len(order) else pack_size - 20
+            # header: 1 bit more, 3 bits type, 4 bits size, then 7 bits size each byte
+            byte = pack[offset]
+            obj_type = (byte >> 4) & 7
+            size = byte & 0x0f
+            shift = 4
+            pos = offset + 1
+            while byte & 0x80:
+                byte = pack[pos]
+                size |= (byte & 0x7f) << shift
+                shift += 7
+                pos += 1
+            objects.append((offset, shas[i], PACK_OBJECT_TYPES.get(obj_type, "unknown"), size, end - offset))
+    return objects
+
+
+def scan_repo_stats(path: str, top: int) -> dict:
+    """
+    object/pack size, work tree files, loc by language and largest blobs of one repo
+    """
+    path = pathlib.Path(path)
+    git_dir = common_git_dir(resolve_git_dir(path))
+    stats = {"pack_bytes": 0, "packs": 0, "loose_bytes": 0, "loose": 0, "files": 0, "tree_bytes": 0,
+             "loc": {}, "largest": []}
+    largest = []
+    pack_dir = git_dir / "objects" / "pack"
+    for idx_path in sorted(pack_dir.glob("*.idx")) if pack_dir.is_dir() else []:
+        stats["packs"] += 1
+        stats["pack_bytes"] += os.path.getsize(idx_path.with_suffix(".pack"))
+        for offset, sha, obj_type, size, packed_size in read_pack_objects(idx_path):
+            if obj_type == "blob":
+                largest.append((size, packed_size, sha))
+        largest = sorted(largest, reverse=True)[:top]
+    stats["largest"] = [{"sha": sha, "size": size, "packed": packed} for size, packed, sha in largest]
+    for sub_dir in (git_dir / "objects").glob("[0-9a-f][0-9a-f]"):
+        for obj in sub_dir.iterdir():
+            stats["loose"] += 1
+            stats["loose_bytes"] += obj.stat().st_size
+
+    ret, stdout, _ = run_command(["git", "ls-files", "-z"], cwd=path)
+    if ret != 0:
+        return stats
+    loc = collections.Counter()
+    for file in stdout.split("\0"):
+        file_path = path / file
+        if file == "" or not file_path.is_file():
+            # sparse checkout or deleted
+            continue
+        stats["files"] += 1
+        stats["tree_bytes"] += file_path.stat().st_size
+        language = LANGUAGE_EXTENSIONS.get(file_path.suffix.lower(), None)
+        if language is None:
+            continue
+        with open(file_path, "rb") as f:
+            content = f.read()
+        if b"\0" in content[:8000]:
+            continue
+        loc[language] += content.count(b"\n")
+    stats["loc"] = dict(loc)
+    return stats
+
+
 # ---------- common cmd mng define ----------
 def get_param_description(function, para_name):
     """
@@ -192,6 +854,14 @@ def build_args(sub_cmds, cls, run_func_name="run"):
 
             parser.add_argument(name, **paras)
 
+    if cls.use_where:
+        parser.add_argument("--where", action="append", default=[], metavar="PREDICATE", type=where_arg,
+                            help="only run in repos matching all predicates: "
+                                 "dirty, clean, ahead, behind, branch=xxx, branch!=xxx")
+    if cls.use_progress:
+        parser.add_argument("--progress", choices=Progress.MODES, default=None,
+                            help="live: redraw status line, plain: summary line every 30s, "
+                                 "auto: live on tty else plain, default from global_config.progress or auto")
     parser.set_defaults(func=functools.partial(run_cmd, cls))
     pass
 
@@ -203,7 +873,7 @@ def run_cmd(cls, para):
     normal_args = cls.normal_args
     default_args = cls.default_args
     annotations = cls.annotations
-    logger.debug(f"run {cls.__name__} {para}")
+    logger.debug("run %s %s", cls.__name__, para)
     # normal args
     if len(normal_args) > 0:
         args = list(para.args)
@@ -212,10 +882,10 @@ def run_cmd(cls, para):
             arg_name = normal_args[i]
             if arg_name in annotations:
                 arg_type = annotations[arg_name]
-                logger.debug(f"trans type {arg_name} -> {arg_type}; str value: {args[i]} ")
+                logger.debug("trans type %s -> %s; str value: %s ", arg_name, arg_type, args[i])
                 args[i] = arg_type(args[i])
         args = tuple(args)
-        logger.debug(f"position args {args}")
+        logger.debug("position args %s", args)
     else:
         args = ()
     # default args
@@ -223,15 +893,157 @@ def run_cmd(cls, para):
         dargs = dict(default_args)
         for key in default_args.keys():
             attr = getattr(para, key)
-            logger.debug(f"get {key} {attr}")
+            logger.debug("get %s %s", key, attr)
             dargs[key] = attr
-        logger.debug(f"default args {dargs}")
+        logger.debug("default args %s", dargs)
     else:
         dargs = {}
+    runner.where = parse_where(list(getattr(para, "where", [])) + cls.implicit_where(**dargs))
+    runner.progress_mode = getattr(para, "progress", None)
     cls.run_cmd(cls, *args, **dargs)
     pass
 
 
+class CmdRegistry:
+    """
+    cmd name -> cmd class, only the selected cmd is imported and gets a full parser
+    built-in cmds register by @register_cmd
+    plugin cmds: entry points in group repm.commands(name = "module:Class"),
+    or CmdBase subclasses in *.py under .repm/plugins of the config dir and dirs in REPM_PLUGIN_PATH,
+    plugins' help is cached in .repm/plugin_cache.json and refreshed when file mtime / package version changes
+    """
+    ENTRY_POINT_GROUP = "repm.commands"
+    PLUGIN_DIR = ".repm/plugins"
+    PLUGIN_CACHE_FILE = ".repm/plugin_cache.json"
+
+    def __init__(self):
+        # name -> {"cls": class} for built-in, {"target": str, "help": str} for plugin
+        self.specs = {}
+        self.plugins_loaded = False
+
+    def register(self, cls):
+        self.specs[cls.cmd] = {"cls": cls, "help": cls.help}
+        return cls
+
+    def plugin_dirs(self):
+        dirs = [runner.base_path / self.PLUGIN_DIR]
+        for path in os.environ.get("REPM_PLUGIN_PATH", "").split(os.pathsep):
+            if path != "":
+                dirs.append(pathlib.Path(path))
+        return dirs
+
+    @staticmethod
+    def entry_points():
+        try:
+            import importlib.metadata as metadata
+        except ImportError:
+            return []
+        eps = metadata.entry_points()
+        if hasattr(eps, "select"):
+            return list(eps.select(group=CmdRegistry.ENTRY_POINT_GROUP))
+        return list(eps.get(CmdRegistry.ENTRY_POINT_GROUP, []))
+
+    @staticmethod
+    def import_file(path: pathlib.Path):
+        spec = importlib.util.spec_from_file_location(f"repm_plugin_{path.stem}", path)
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[spec.name] = module
+        spec.loader.exec_module(module)
+        return module
+
+    @staticmethod
+    def import_target(target: str):
+        """
+        target: "module:Class" or "file:<path>:Class"
+        """
+        if target.startswith("file:"):
+            path, _, class_name = target[len("file:"):].rpartition(":")
+            module = CmdRegistry.import_file(pathlib.Path(path))
+        else:
+            module_name, _, class_name = target.partition(":")
+            module = importlib.import_module(module_name)
+        return getattr(module, class_name)
+
+    def discover_plugins(self):
+        """
+        collect plugin cmds, import only sources not in cache
+        """
+        if self.plugins_loaded:
+            return
+        self.plugins_loaded = True
+        cache_file = runner.base_path / self.PLUGIN_CACHE_FILE
+        cache = load_json(cache_file, {})
+        new_cache = {}
+        sources = []
+        for ep in self.entry_points():
+            version = getattr(getattr(ep, "dist", None), "version", "")
+            sources.append((f"ep:{ep.name}={ep.value}", version, ep))
+        for plugin_dir in self.plugin_dirs():
+            if plugin_dir.is_dir():
+                for path in sorted(plugin_dir.glob("*.py")):
+                    sources.append((f"file:{path.resolve()}", path.stat().st_mtime_ns, path))
+        for key, stamp, source in sources:
+            cached = cache.get(key, None)
+            specs = None
+            if cached is None or cached["stamp"] != stamp:
+                try:
+                    specs = self.describe_source(source)
+                except Exception as e:
+                    cmd_logger.error(f"load plugin fail | {key} | {e!r}")
+                    continue
+                # classes are not saved, they are only for this run
+                cmds = {name: {k: v for k, v in spec.items() if k != "cls"} for name, spec in specs.items()}
+                cached = {"stamp": stamp, "cmds": cmds}
+            new_cache[key] = cached
+            for name, spec in (specs or cached["cmds"]).items():
+                if name in self.specs:
+                    cmd_logger.debug("plugin cmd %s ignored, already defined", name)
+                    continue
+                self.specs[name] = spec
+        if new_cache != cache:
+            save_json(cache_file, new_cache)
+
+    def describe_source(self, source):
+        """
+        import a plugin source to get its cmds' help, only on cache miss
+        the imported class is kept in "cls", load must not run the plugin file again
+        """
+        if isinstance(source, pathlib.Path):
+            module = self.import_file(source)
+            cmds = {}
+            for obj in vars(module).values():
+                if isinstance(obj, type) and issubclass(obj, CmdBase) and obj.__module__ == module.__name__:
+                    cmds[obj.cmd] = {"target": f"file:{source.resolve()}:{obj.__name__}", "help": obj.help,
+                                     "cls": obj}
+            return cmds
+        cls = source.load()
+        return {source.name: {"target": source.value, "help": cls.help, "cls": cls}}
+
+    def names(self):
+        return sorted(self.specs.keys())
+
+    def load(self, name: str):
+        spec = self.specs[name]
+        if "cls" not in spec:
+            spec["cls"] = self.import_target(spec["target"])
+        return spec["cls"]
+
+
+cmd_registry = CmdRegistry()
+register_cmd = cmd_registry.register
+
+
+def select_cmd_name(argv, names):
+    """
+    first positional arg is the cmd, global options are all flags
+    """
+    for arg in argv:
+        if arg.startswith("-"):
+            continue
+        return arg if arg in names else None
+    return None
+
+
 def cmd_main(args=None):
     """
     main args builder
@@ -243,22 +1055,522 @@ def cmd_main(args=None):
 multi git repositories mng
 """)
     root.set_defaults(func=lambda *args: root.print_help())
-
+    root.add_argument("-v", "--verbose", action="store_true", help="print debug logs")
+    root.add_argument("--log_files", action="store_true",
+                      help="write run.log and one log per repo under .repm/logs/<time>/, also global_config.log_files")
+
+    if args is None:
+        args = sys.argv[1:]
+    cmd_registry.discover_plugins()
+    names = cmd_registry.names()
+    selected = select_cmd_name(args, names)
     sub_cmds = root.add_subparsers(help=f"supported cmds:")
-    curr_module = inspect.getmodule(inspect.currentframe())
-    for name, obj in inspect.getmembers(curr_module):
-        if inspect.isclass(obj) and issubclass(obj, CmdBase) and name != "CmdBase":
-            logger.debug(f"get one cmd {name}")
-            build_args(sub_cmds, obj)
+    for name in names:
+        if name == selected:
+            logger.debug("build cmd %s", name)
+            build_args(sub_cmds, cmd_registry.load(name))
+        else:
+            # only name and help for not selected cmds
+            sub_cmds.add_parser(name, help=cmd_registry.specs[name]["help"])
 
     args = root.parse_args(args)
+    set_verbose(args.verbose, args.log_files)
+    runner.log_files = args.log_files
     # execute
     args.func(args)
 
 
+class AdaptiveLimiter:
+    """
+    AIMD concurrency for jobs: auto
+    each window(limit completions) +1 if throughput not dropping and machine not overloaded,
+    halve on transient network errors(429/timeout/...), -1 when throughput drops or load/io wait too high
+    """
+    TRANSIENT_ERROR = re.compile(r"429|too many requests|timed? ?out|connection reset|early eof|rpc failed|"
+                                 r"could not resolve host|remote end hung up|temporarily unavailable", re.IGNORECASE)
+    # workload: (start, upper) as multiple of cpu count
+    WORKLOADS = {"network": (1, 8), "disk": (0.5, 2), "cpu": (0.5, 1)}
+    # throughput of too small windows is noise
+    MIN_WINDOW = 4
+
+    def __init__(self, workload: str):
+        cpu = multiprocessing.cpu_count()
+        start, upper = self.WORKLOADS.get(workload, self.WORKLOADS["cpu"])
+        self.workload = workload
+        self.cpu = cpu
+        self.lower = 1
+        self.upper = max(2, int(cpu * upper))
+        self.limit = max(self.lower, min(self.upper, int(cpu * start)))
+        self.lock = threading.Lock()
+        self.window_begin = time.time()
+        self.window_done = 0
+        self.last_throughput = None
+        self.backoff_left = 0
+        self.last_cpu_times = self.read_cpu_times()
+        cmd_logger.info(f"adaptive jobs | {workload} | start {self.limit}, range [{self.lower}, {self.upper}]")
+
+    @staticmethod
+    def read_cpu_times():
+        try:
+            with open("/proc/stat") as f:
+                return [int(x) for x in f.readline().split()[1:]]
+        except (OSError, ValueError):
+            return None
+
+    def io_wait(self):
+        """
+        io wait ratio since last call, 0 if not linux
+        """
+        curr = self.read_cpu_times()
+        last, self.last_cpu_times = self.last_cpu_times, curr
+        if curr is None or last is None or len(curr) < 5:
+            return 0
+        total = sum(curr) - sum(last)
+        if total <= 0:
+            return 0
+        return (curr[4] - last[4]) / total
+
+    def overloaded(self):
+        reasons = []
+        if hasattr(os, "getloadavg") and self.workload != "network":
+            load = os.getloadavg()[0]
+            if load > self.cpu * 1.5:
+                reasons.append(f"load {load:.1f}")
+        io_wait = self.io_wait()
+        if io_wait > 0.3:
+            reasons.append(f"iowait {io_wait:.0%}")
+        return ", ".join(reasons)
+
+    def set_limit(self, limit: int, reason: str):
+        limit = max(self.lower, min(self.upper, limit))
+        if limit != self.limit:
+            cmd_logger.info(f"adaptive jobs | {self.limit} -> {limit} | {reason}")
+            self.limit = limit
+
+    def on_done(self, success: bool, err: str):
+        with self.lock:
+            if not success and err and self.TRANSIENT_ERROR.search(err):
+                # one multiplicative decrease per window
+                if self.backoff_left <= 0:
+                    self.set_limit(self.limit // 2, f"transient error: {self.TRANSIENT_ERROR.search(err).group(0)}")
+                    self.backoff_left = self.limit
+                    self.window_begin = time.time()
+                    self.window_done = 0
+                    self.last_throughput = None
+                return
+            self.backoff_left -= 1
+            self.window_done += 1
+            if self.window_done < max(self.limit, self.MIN_WINDOW):
+                return
+            now = time.time()
+            throughput = self.window_done / max(now - self.window_begin, 1e-3)
+            overloaded = self.overloaded()
+            if overloaded:
+                self.set_limit(self.limit - 1, overloaded)
+            elif self.last_throughput is not None and throughput < self.last_throughput * 0.7:
+                self.set_limit(self.limit - 1, f"throughput {self.last_throughput:.2f} -> {throughput:.2f}/s")
+            elif self.backoff_left <= 0:
+                self.set_limit(self.limit + 1, f"throughput {throughput:.2f}/s")
+            self.last_throughput = throughput
+            self.window_begin = now
+            self.window_done = 0
+
+
+class Progress:
+    """
+    live progress of one run
+    workers only record start under a lock, drawing is done by a background thread:
+    live: redraw one status line on stderr, plain: one summary line every plain_interval seconds
+    """
+    MODES = ("auto", "live", "plain", "off")
+
+    def __init__(self, need_exec, mode: str = "auto", interval: float = 0.5, plain_interval: float = 30):
+        if mode == "auto":
+            mode = "live" if sys.stderr.isatty() else "plain"
+        self.mode = mode
+        self.interval = interval if mode == "live" else plain_interval
+        self.total = len(need_exec)
+        self.hosts = {id(item): remote_host(item.get("remote", None) or "") for item in need_exec}
+        self.lock = threading.Lock()
+        self.running = {}
+        self.done = 0
+        self.failed = 0
+        self.skipped = 0
+        self.begin = time.time()
+        self.drawn = False
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        if self.mode in ("live", "plain") and self.total > 0:
+            self.thread = threading.Thread(target=self.render_loop, name="progress", daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        if self.thread is None:
+            return
+        self.stop_event.set()
+        self.thread.join()
+        self.clear_line()
+
+    def task_start(self, item):
+        with self.lock:
+            self.running[id(item)] = (item["name"], time.time())
+
+    def task_end(self, item, success: bool):
+        with self.lock:
+            self.running.pop(id(item), None)
+            if success:
+                self.done += 1
+            else:
+                self.failed += 1
+
+    def task_retry(self, item):
+        with self.lock:
+            self.failed -= 1
+
+    def task_skip(self):
+        with self.lock:
+            self.skipped += 1
+
+    def render_line(self) -> str:
+        with self.lock:
+            running = dict(self.running)
+            done, failed, skipped = self.done, self.failed, self.skipped
+        now = time.time()
+        finished = done + failed + skipped
+        queued = self.total - finished - len(running)
+        elapsed = max(now - self.begin, 1e-3)
+        rate = (done + failed) / elapsed * 60
+        line = f"[{finished}/{self.total}] done:{done} fail:{failed} run:{len(running)} queue:{queued}"
+        if skipped > 0:
+            line += f" skip:{skipped}"
+        line += f" | {rate:.1f}/min"
+        if done + failed > 0 and queued + len(running) > 0:
+            eta = (queued + len(running)) / (rate / 60)
+            line += f" eta {int(eta // 60)}m{int(eta % 60):02d}s"
+        hosts = collections.Counter(self.hosts.get(key, "local") for key in running)
+        if len(hosts) > 0:
+            line += " | " + " ".join(f"{host}:{count}" for host, count in hosts.most_common(3))
+        longest = sorted(running.values(), key=lambda x: x[1])[:3]
+        if len(longest) > 0:
+            line += " | longest: " + ", ".join(f"{name} {now - begin:.0f}s" for name, begin in longest)
+        return line
+
+    def render_loop(self):
+        while not self.stop_event.wait(self.interval):
+            line = self.render_line()
+            if self.mode == "plain":
+                cmd_logger.info(f"progress {line}")
+                continue
+            width = shutil.get_terminal_size().columns - 1
+            with self.lock:
+                sys.stderr.write("\r\x1b[K" + line[:width])
+                sys.stderr.flush()
+                self.drawn = True
+
+    def clear_line(self):
+        with self.lock:
+            self.clear_line_locked()
+
+    def clear_line_locked(self):
+        """
+        clear live line before a log line is printed, caller holds self.lock
+        """
+        if not self.drawn:
+            return
+        sys.stderr.write("\r\x1b[K")
+        sys.stderr.flush()
+        self.drawn = False
+
+
+class RepoPool:
+    """
+    GitPython Repo handles shared by all workers
+    a Repo keeps git cat-file --batch processes and open files until closed,
+    so a handle is closed as soon as its last user releases it, unless tasks of the same path are still pending,
+    idle pending ones over max_open are closed in LRU order and all are closed when a run ends
+    """
+    DEFAULT_MAX_OPEN = 32
+
+    def __init__(self, max_open: int = DEFAULT_MAX_OPEN):
+        self.lock = threading.Lock()
+        self.max_open = max_open
+        # path -> [Repo, users], oldest used first
+        self.handles = collections.OrderedDict()
+        # path -> tasks not finished, see expect/finish
+        self.pending = collections.Counter()
+        self.opened = 0
+        self.reused = 0
+        self.closed = 0
+        self.evicted = 0
+
+    def expect(self, paths):
+        """
+        tasks of paths will run, keep their handles open between them
+        """
+        with self.lock:
+            self.pending.update(str(path) for path in paths)
+
+    def finish(self, path):
+        """
+        one task of path finished, call before releasing its handle
+        """
+        key = str(path)
+        with self.lock:
+            if self.pending[key] > 1:
+                self.pending[key] -= 1
+            else:
+                del self.pending[key]
+
+    def acquire(self, path) -> repo.Repo:
+        key = str(path)
+        with self.lock:
+            handle = self.handles.get(key, None)
+            if handle is not None:
+                handle[1] += 1
+                self.handles.move_to_end(key)
+                self.reused += 1
+                return handle[0]
+        # open outside lock, may be slow
+        curr_repo = repo.Repo(path)
+        with self.lock:
+            handle = self.handles.get(key, None)
+            if handle is not None:
+                # opened by another worker at the same time
+                curr_repo.close()
+                handle[1] += 1
+                self.reused += 1
+                return handle[0]
+            self.handles[key] = [curr_repo, 1]
+            self.opened += 1
+            self.evict_idle()
+        return curr_repo
+
+    def release(self, path):
+        key = str(path)
+        with self.lock:
+            handle = self.handles.get(key, None)
+            if handle is None:
+                return
+            handle[1] -= 1
+            if handle[1] <= 0 and self.pending[key] <= 0:
+                del self.handles[key]
+                handle[0].close()
+                self.closed += 1
+            self.evict_idle()
+
+    def evict_idle(self):
+        """
+        close idle handles until under max_open, must hold lock
+        handles in use are never closed, so the pool may be over max_open when all are busy
+        """
+        over = len(self.handles) - self.max_open
+        if over <= 0:
+            return
+        for key in list(self.handles.keys()):
+            if over <= 0:
+                break
+            curr_repo, users = self.handles[key]
+            if users > 0:
+                continue
+            del self.handles[key]
+            curr_repo.close()
+            self.evicted += 1
+            over -= 1
+
+    def close_all(self):
+        with self.lock:
+            for curr_repo, users in self.handles.values():
+                curr_repo.close()
+            self.handles.clear()
+            self.pending.clear()
+            if self.opened > 0:
+                cmd_logger.info(f"repo handles | opened:{self.opened} reused:{self.reused} closed:{self.closed} "
+                                f"evicted:{self.evicted}")
+            self.opened = self.reused = self.closed = self.evicted = 0
+
+
+repo_pool = RepoPool()
+
+
+class SshMux:
+    """
+    one ssh ControlMaster per remote host for a run, all git ssh connections of workers go through it
+    enabled by global_config.ssh_mux for network cmds:
+    ssh_mux_sessions: max channels per master, sshd's MaxSessions defaults to 10
+    ssh_mux_persist: master exits after idle seconds, so it does not outlive a crashed run
+    hosts whose master fails to start connect directly as before
+    """
+    DEFAULT_SESSIONS = 8
+    DEFAULT_PERSIST = 300
+    START_TIMEOUT = 30
+
+    def __init__(self):
+        self.control_dir = None
+        self.masters = []
+        self.sessions = self.DEFAULT_SESSIONS
+        self.old_ssh_command = None
+
+    @property
+    def active(self):
+        return self.control_dir is not None
+
+    def control_path(self):
+        # %C is hash of local host, remote host, port and user, short enough for unix socket path limit
+        return os.path.join(self.control_dir, "%C")
+
+    @staticmethod
+    def target_args(target):
+        user, host, port = target
+        args = []
+        if port is not None:
+            args += ["-p", str(port)]
+        if user is not None:
+            args += ["-l", user]
+        return args + [host]
+
+    def start(self, need_exec, global_conf):
+        targets = sorted({target for target in (parse_ssh_remote(item.get("remote", None) or "")
+                                                for item in need_exec) if target is not None},
+                         key=lambda target: tuple(str(x) for x in target))
+        if len(targets) == 0:
+            return
+        self.sessions = int(global_conf.get("ssh_mux_sessions", None) or self.DEFAULT_SESSIONS)
+        persist = int(global_conf.get("ssh_mux_persist", None) or self.DEFAULT_PERSIST)
+        ssh = os.environ.get("GIT_SSH_COMMAND", None) or "ssh"
+        # parsed before anything is changed, a bad command leaves nothing for stop to undo
+        ssh_args = shlex.split(ssh)
+        self.old_ssh_command = os.environ.get("GIT_SSH_COMMAND", None)
+        self.control_dir = tempfile.mkdtemp(prefix="repm-ssh-")
+        base = ssh_args + ["-o", f"ControlPath={self.control_path()}"]
+        master_args = ["-M", "-N", "-f", "-o", "BatchMode=yes", "-o", f"ControlPersist={persist}"]
+
+        def start_master(target):
+            # master stays in background with -f, pipes would be held open by it, so stderr goes to a file
+            with tempfile.TemporaryFile(mode="w+") as err_file:
+                try:
+                    ret = subprocess.run(base + master_args + self.target_args(target), stdin=subprocess.DEVNULL,
+                                         stdout=subprocess.DEVNULL, stderr=err_file,
+                                         timeout=self.START_TIMEOUT).returncode
+                except subprocess.TimeoutExpired:
+                    ret = -1
+                err_file.seek(0)
+                return target, ret, err_file.read()
+
+        begin = time.time()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(16, len(targets))) as executor:
+            for target, ret, err in executor.map(start_master, targets):
+                if ret == 0:
+                    self.masters.append(target)
+                else:
+                    cmd_logger.warning(f"ssh master fail | {target[1]} | {err.strip()}")
+        # workers only use existing masters, never become one, user's command is kept as written
+        mux_args = shlex.join(["-o", "ControlMaster=no", "-o", f"ControlPath={self.control_path()}"])
+        os.environ["GIT_SSH_COMMAND"] = f"{ssh} {mux_args}"
+        cmd_logger.info(f"ssh mux | {len(self.masters)}/{len(targets)} masters in {time.time() - begin:.2f}s "
+                        f"| max sessions {self.sessions}")
+
+    def slot(self, item):
+        """
+        limit channels on one master, no limit for repos without master
+        """
+        if not self.active:
+            return contextlib.nullcontext()
+        target = parse_ssh_remote(item.get("remote", None) or "")
+        if target not in self.masters:
+            return contextlib.nullcontext()
+        return host_limiter.slot(f"ssh-mux:{target}", self.sessions)
+
+    def stop(self):
+        if not self.active:
+            return
+        base = shlex.split(self.old_ssh_command or "ssh") + ["-o", f"ControlPath={self.control_path()}"]
+        for target in self.masters:
+            ret, out, err = run_command(base + ["-O", "exit"] + self.target_args(target), timeout=self.START_TIMEOUT)
+            if ret != 0:
+                cmd_logger.debug("ssh master exit fail | %s | %s", target[1], err.strip())
+        if self.old_ssh_command is None:
+            os.environ.pop("GIT_SSH_COMMAND", None)
+        else:
+            os.environ["GIT_SSH_COMMAND"] = self.old_ssh_command
+        shutil.rmtree(self.control_dir, ignore_errors=True)
+        self.control_dir = None
+        self.masters = []
+
+
+ssh_mux = SshMux()
+
+
 # ---------- repositories mng base define ----------
+class Workspace:
+    """
+    one config file and the repos under its dir
+    """
+
+    def __init__(self, name: str, base_path: pathlib.Path, global_conf: dict, all_repos: dict):
+        self.name = name
+        self.base_path = base_path
+        self.global_conf = global_conf
+        self.all_repos = all_repos
+
+    def display_path(self, local: str) -> str:
+        """
+        repo's path relative to the top workspace
+        """
+        if self.name == ".":
+            return local
+        return f"{self.name}/{local}"
+
+    def repos(self):
+        need_exec = []
+        for category_name, category_repos in self.all_repos.items():
+            if category_name == "__root__":
+                sub_path = ""
+            else:
+                sub_path = f"{category_name}/"
+            logger.debug("%s", category_name)
+            for repo_name, repo_conf in (category_repos or {}).items():
+                repo_conf = copy.deepcopy(repo_conf)
+                local_dir = sub_path + (repo_conf.get("local", None) or repo_name)
+                repo_conf["local"] = local_dir
+                repo_conf["name"] = repo_name
+                repo_conf["category"] = category_name
+                repo_conf["workspace"] = self
+                need_exec.append(repo_conf)
+                need_exec += self.worktree_items(repo_conf, sub_path)
+        return need_exec
+
+    @staticmethod
+    def worktree_items(repo_conf: dict, sub_path: str) -> list:
+        """
+        worktrees: {name: branch or {branch: xx, local: xx}} or [branch, ...]
+        each worktree is a repo of its own(name@worktree, default local <local>@<name>),
+        sharing objects and remote refs with the main clone, so it depends on the main repo
+        """
+        worktrees = repo_conf.get("worktrees", None) or {}
+        if isinstance(worktrees, list):
+            worktrees = {branch.replace("/", "-"): branch for branch in worktrees}
+        items = []
+        for worktree_name, worktree_conf in worktrees.items():
+            if isinstance(worktree_conf, str):
+                worktree_conf = {"branch": worktree_conf}
+            item = {key: value for key, value in repo_conf.items() if key not in ("worktrees", "depends_on")}
+            item.update(worktree_conf)
+            if worktree_conf.get("local", None):
+                item["local"] = sub_path + worktree_conf["local"]
+            else:
+                item["local"] = f"{repo_conf['local']}@{worktree_name}"
+            item["name"] = f"{repo_conf['name']}@{worktree_name}"
+            item["worktree_of"] = repo_conf["local"]
+            item["depends_on"] = [f"{repo_conf['category']}/{repo_conf['name']}"]
+            items.append(item)
+        return items
+
+
 class GitCmdRunner:
     CONFIG_FILE_NAME = "Repositories.yaml"
+    LOG_DIR = ".repm/logs"
 
     def __init__(self):
         curr_path = os.getcwd()
@@ -269,62 +1581,274 @@ class GitCmdRunner:
         self.relative_path = relative_path
         self.base_path = base_path
         self.current_path = curr_path
+        # predicates from --where, repos not matching are not dispatched
+        self.where = []
+        # --log_files, write per repo log files under LOG_DIR
+        self.log_files = False
+        # --progress mode, and progress of current run
+        self.progress_mode = None
+        self.progress = None
+
+    def load_workspaces(self):
+        """
+        load config file and all config files it includes
+        include: [dir or config file path relative to the including config's dir]
+        included workspace's global_config overrides the including one's, except jobs, all workspaces share one pool
+        """
+        workspaces = []
+        loaded = set()
+
+        def load(config_file: pathlib.Path, parent_conf: dict):
+            config_file = config_file.resolve()
+            if config_file in loaded:
+                return
+            loaded.add(config_file)
+            with open(config_file) as f:
+                conf: dict = yaml.load(f, yaml.FullLoader) or {}
+            global_conf = dict(parent_conf)
+            global_conf.update(conf.get("global_config", None) or {})
+            base_path = config_file.parent
+            name = os.path.relpath(base_path, self.base_path.resolve()).replace(os.sep, "/")
+            workspaces.append(Workspace(name, base_path, global_conf, conf.get("all_repos", None) or {}))
+            for include in conf.get("include", None) or []:
+                include_path = base_path / include
+                if include_path.is_dir():
+                    include_path = include_path / self.CONFIG_FILE_NAME
+                load(include_path, global_conf)
+
+        load(self.base_path / self.CONFIG_FILE_NAME, {})
+        repo_pool.max_open = workspaces[0].global_conf.get("repo_handles", None) or RepoPool.DEFAULT_MAX_OPEN
+        return workspaces
+
+    def load_config(self, worktrees: bool = True):
+        """
+        load config file, return global config and all repos' config
+        :param worktrees: include worktree repos, see Workspace.worktree_items
+        """
+        workspaces = self.load_workspaces()
+        need_exec = []
+        for workspace in workspaces:
+            need_exec += workspace.repos()
+        if not worktrees:
+            need_exec = [item for item in need_exec if "worktree_of" not in item]
+        # check depends_on of whole config, subset run later ignores repos not selected
+        self.build_dependencies(need_exec)
+        return workspaces[0].global_conf, need_exec
+
+    def select_by_where(self, need_exec):
+        """
+        evaluate --where for all repos in one parallel pass before dispatch
+        """
+        if len(self.where) == 0:
+            return need_exec
+        begin = time.time()
+        need_status = any(key != "branch" for key, _, _ in self.where)
+        paths = [item["workspace"].base_path / item["local"] for item in need_exec]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(32, multiprocessing.cpu_count() * 4)) as executor:
+            states = list(executor.map(lambda path: read_repo_state(path, need_status), paths))
+        selected = [item for item, state in zip(need_exec, states) if match_where(state, self.where)]
+        where_str = " ".join(f"{key}{op}{value or ''}" for key, op, value in self.where)
+        cmd_logger.info(f"where {where_str} | {len(selected)}/{len(need_exec)} repos in {time.time() - begin:.2f}s")
+        return selected
 
-    def create_and_run_cmd(self, cls, *args, **kwargs):
-        base_path = self.base_path
-        # load config file
-        with open((base_path / self.CONFIG_FILE_NAME)) as f:
-            conf: dict = yaml.load(f, yaml.FullLoader)
-
-        global_conf = conf.get("global_config", None) or {}
+    @staticmethod
+    def make_jobs(cls, global_conf):
+        """
+        jobs in global_config or cls's default, "auto" for adaptive concurrency
+        """
         jobs = global_conf.get("jobs", None) or cls.jobs_num
+        if jobs == "auto":
+            return AdaptiveLimiter(cls.workload)
         assert jobs > 0
         cmd_logger.info(f"run with jobs {jobs}")
-        all_repos = conf["all_repos"] or {}
+        return jobs
 
-        # select needs
-        need_exec = []
-        for category_name, category_repos in all_repos.items():
-            if category_name == "__root__":
-                sub_path = ""
-            else:
-                sub_path = f"{category_name}/"
-            logger.debug(f"{category_name}")
-            for repo_name, repo_conf in category_repos.items():
-                repo_conf = copy.deepcopy(repo_conf)
-                local_dir = sub_path + (repo_conf.get("local", None) or repo_name)
-                repo_conf["local"] = local_dir
-                repo_conf["name"] = repo_name
-                repo_conf["category"] = category_name
-                need_exec.append(repo_conf)
-                pass
+    def create_and_run_cmd(self, cls, *args, **kwargs):
+        global_conf, need_exec = self.load_config(cls.worktrees)
+        jobs = self.make_jobs(cls, global_conf)
+        return self.execute(cls, need_exec, jobs, *args, **kwargs)
 
+    @staticmethod
+    def build_dependencies(need_exec, strict=True):
+        """
+        resolve each repo's depends_on into indexes of need_exec
+        repo can be referred by name or category/name, repos in the same workspace first
+        :param strict: raise on unknown repo, else ignore it(not selected in this run)
+        :return: list of dependency index set, same order as need_exec
+        """
+        by_key = {}
+        for i, item in enumerate(need_exec):
+            workspace = item["workspace"].name
+            for key in (item["name"], f"{item['category']}/{item['name']}"):
+                by_key.setdefault(key, []).append(i)
+                by_key.setdefault((workspace, key), []).append(i)
+
+        deps = []
+        for item in need_exec:
+            depends_on = item.get("depends_on", None) or []
+            if isinstance(depends_on, str):
+                depends_on = [depends_on]
+            curr = set()
+            for key in depends_on:
+                found = by_key.get((item["workspace"].name, key), None) or by_key.get(key, [])
+                if len(found) == 0:
+                    if not strict:
+                        continue
+                    raise ValueError(f"{item['name']} depends on unknown repo {key}")
+                if len(found) > 1:
+                    raise ValueError(f"{item['name']} depends on ambiguous repo {key}, use category/name")
+                curr.add(found[0])
+            deps.append(curr)
+
+        # kahn, whatever left is in a cycle
+        in_degree = [len(d) for d in deps]
+        dependents = [[] for _ in need_exec]
+        for i, d in enumerate(deps):
+            for j in d:
+                dependents[j].append(i)
+        queue = [i for i, n in enumerate(in_degree) if n == 0]
+        visited = 0
+        while queue:
+            i = queue.pop()
+            visited += 1
+            for j in dependents[i]:
+                in_degree[j] -= 1
+                if in_degree[j] == 0:
+                    queue.append(j)
+        if visited != len(need_exec):
+            cycle = [need_exec[i]["name"] for i, n in enumerate(in_degree) if n > 0]
+            raise ValueError(f"depends_on has cycle in: {cycle}")
+        return deps
+
+    def execute(self, cls, need_exec, jobs, *args, **kwargs):
+        """
+        run cls on need_exec in thread pool
+        a repo starts as soon as all of its depends_on succeed, repos after a failed one are skipped
+        :param jobs: fixed jobs number or AdaptiveLimiter
+        """
+        limiter = None
+        if isinstance(jobs, AdaptiveLimiter):
+            limiter = jobs
+            jobs = limiter.upper
+        need_exec = self.select_by_where(need_exec)
+        deps = self.build_dependencies(need_exec, strict=False)
+        dependents = [[] for _ in need_exec]
+        for i, d in enumerate(deps):
+            for j in d:
+                dependents[j].append(i)
+        waiting = [set(d) for d in deps]
+        ready = collections.deque(i for i, d in enumerate(waiting) if len(d) == 0)
+        # retry on transient errors(429/timeout/...), retries in global_config
+        retries = collections.Counter()
+
+        success_tasks = []
+        fail_tasks = []
+        skip_tasks = []
+        global_conf = need_exec[0]["workspace"].global_conf if len(need_exec) > 0 else {}
+        if (self.log_files or global_conf.get("log_files", False)) and repo_log_handle.run_dir is None:
+            run_dir = self.base_path / self.LOG_DIR / time.strftime("%Y%m%d_%H%M%S")
+            set_verbose(False, True)
+            repo_log_handle.start(run_dir)
+            cmd_logger.info(f"log files in {run_dir}")
+        progress = Progress(need_exec, self.progress_mode or global_conf.get("progress", None) or "auto")
+        self.progress = progress
+        progress.start()
+        repo_pool.expect(item["workspace"].base_path / item["local"] for item in need_exec)
         curr_pool = concurrent.futures.ThreadPoolExecutor
-        with curr_pool(max_workers=jobs) as executor:
-            tasks = []
-            for item in need_exec:
-                fu = executor.submit(GitCmdRunner.cmd_execute_worker, item, cls, global_conf, base_path, *args,
-                                     **kwargs)
-                tasks.append(fu)
-            success_tasks = []
-            fail_tasks = []
-            for fu in concurrent.futures.as_completed(tasks):
-                success, item = fu.result()
-                if success:
-                    success_tasks.append(item)
-                else:
-                    fail_tasks.append(item)
-            info = f"total:{len(need_exec)} success:{len(success_tasks)} fail:{len(fail_tasks)}:{fail_tasks}"
-            if len(fail_tasks) > 0:
-                info += f" fail tasks:{fail_tasks}"
-            cmd_logger.info(info)
+        try:
+            if global_conf.get("ssh_mux", False) and cls.workload == "network":
+                ssh_mux.start(need_exec, global_conf)
+            with curr_pool(max_workers=jobs) as executor:
+                running = {}
+                while ready or running:
+                    while ready and (limiter is None or len(running) < limiter.limit):
+                        i = ready.popleft()
+                        fu = executor.submit(GitCmdRunner.cmd_execute_worker, need_exec[i], cls, progress,
+                                             *args, **kwargs)
+                        running[fu] = i
+                    done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+                    for fu in done:
+                        i = running.pop(fu)
+                        item = need_exec[i]
+                        try:
+                            success, _, err = fu.result()
+                        except Exception as e:
+                            cmd_logger.error(f"fail | {item['name']} | {e!r}")
+                            success, err = False, repr(e)
+                        if limiter is not None:
+                            limiter.on_done(success, err)
+                        progress.task_end(item, success)
+                        if success:
+                            success_tasks.append(item)
+                            for j in dependents[i]:
+                                # already skipped by another failed dependency
+                                if waiting[j] is None:
+                                    continue
+                                waiting[j].discard(i)
+                                if len(waiting[j]) == 0:
+                                    ready.append(j)
+                            continue
+                        max_retries = item["workspace"].global_conf.get("retries", 0)
+                        if retries[i] < max_retries and err and AdaptiveLimiter.TRANSIENT_ERROR.search(err):
+                            retries[i] += 1
+                            cmd_logger.info(f"retry {retries[i]}/{max_retries} | {item['name']} | "
+                                            f"{AdaptiveLimiter.TRANSIENT_ERROR.search(err).group(0)}")
+                            progress.task_retry(item)
+                            repo_pool.expect([item["workspace"].base_path / item["local"]])
+                            ready.append(i)
+                            continue
+                        fail_tasks.append(item)
+                        # skip all downstream
+                        stack = list(dependents[i])
+                        while stack:
+                            j = stack.pop()
+                            if waiting[j] is None:
+                                continue
+                            waiting[j] = None
+                            repo_pool.finish(need_exec[j]["workspace"].base_path / need_exec[j]["local"])
+                            skip_tasks.append(need_exec[j])
+                            progress.task_skip()
+                            cmd_logger.info(f"skip | {need_exec[j]['name']} | depends on failed {item['name']}")
+                            stack.extend(dependents[j])
+        finally:
+            ssh_mux.stop()
+            repo_pool.close_all()
+            progress.stop()
+            self.progress = None
+        info = f"total:{len(need_exec)} success:{len(success_tasks)} fail:{len(fail_tasks)}"
+        if limiter is not None:
+            info += f" final jobs:{limiter.limit}"
+        if len(retries) > 0:
+            info += f" retried:{sum(retries.values())}"
+        if len(skip_tasks) > 0:
+            info += f" skip:{len(skip_tasks)}"
+        if len(fail_tasks) > 0:
+            info += f" fail tasks:{[item['name'] for item in fail_tasks]}"
+        cmd_logger.info(info)
+        cls.summary(success_tasks + fail_tasks)
+        workspaces = sorted({item["workspace"].name for item in need_exec})
+        if len(workspaces) > 1:
+            for name in workspaces:
+                count = [len([item for item in items if item["workspace"].name == name])
+                         for items in (success_tasks, fail_tasks, skip_tasks)]
+                cmd_logger.info(f"  workspace {name} | success:{count[0]} fail:{count[1]} skip:{count[2]}")
+        return success_tasks, fail_tasks, skip_tasks
 
     @staticmethod
-    def cmd_execute_worker(item, cls, global_conf, base_path, *args, **kwargs):
-        cmd = cls(global_conf, item, base_path)
-        ret, info, err = cmd.run(*args, **kwargs)
+    def cmd_execute_worker(item, cls, progress, *args, **kwargs):
+        progress.task_start(item)
+        workspace = item["workspace"]
+        log_context.repo = workspace.display_path(item["local"])
+        cmd = cls(workspace.global_conf, item, workspace.base_path)
+        try:
+            with ssh_mux.slot(item):
+                ret, info, err = cmd.run(*args, **kwargs)
+        finally:
+            repo_pool.finish(cmd.repo_path)
+            cmd.close()
+            log_context.repo = None
         success = (ret == 0)
-        return success, item
+        return success, item, err
 
 
 runner = GitCmdRunner()
@@ -335,6 +1859,13 @@ class CmdBase:
     description = "CmdBase desc"
     help = description
     jobs_num = multiprocessing.cpu_count()
+    # network/disk/cpu, decides adaptive concurrency range when jobs is auto
+    workload = "cpu"
+    # run on worktrees as separate repos, False for cmds working on the shared repo data
+    worktrees = True
+    # cmd selects repos by --where / reports by --progress, else the option is not added
+    use_where = True
+    use_progress = True
 
     @staticmethod
     def run_cmd(cls, *args, **kwargs):
@@ -369,19 +1900,31 @@ class CmdBase:
             return self.global_conf[key]
         raise KeyError(f"key {key} not exists")
 
+    @property
+    def repo_path(self) -> pathlib.Path:
+        return self.base_path / self.value("local")
+
     @property
     def repository(self) -> repo.Repo:
         if self.curr_repo is not None:
             return self.curr_repo
         local_path = self.value("local")
-        curr_path = self.base_path / local_path
+        curr_path = self.repo_path
         if not curr_path.exists():
             logger.info(f"project not cloned : {self.name} {local_path}")
             return None
 
-        self.curr_repo = repo.Repo(self.value("local"))
+        self.curr_repo = repo_pool.acquire(curr_path)
         return self.curr_repo
 
+    def close(self):
+        """
+        give back repository handle to pool
+        """
+        if self.curr_repo is not None:
+            self.curr_repo = None
+            repo_pool.release(self.repo_path)
+
     def execute_cmd_in_rep_dir(self, cmd_str):
         if self.repository is None:
             return 0, "", f""
@@ -392,7 +1935,9 @@ class CmdBase:
         all_stderr = ""
         for cmd in cmds:
             cmd: str = cmd.strip()
-            all_status, stdout, stderr = run_command(cmd)
+            all_status, stdout, stderr = run_command(cmd, cwd=self.repo_path,
+                                                     timeout=self.value_or_default("timeout", None))
+            cmd_logger.debug("exec | %s | %s | %s\n%s%s", self.name, cmd, all_status, stdout, stderr)
             all_stdout += f"run {cmd} get :\n"
             all_stdout += f"{stdout}\n"
             all_stderr += f"{stderr}\n"
@@ -404,6 +1949,61 @@ class CmdBase:
     def run(self, *args, **kwargs):
         return 0, "", ""
 
+    @classmethod
+    def implicit_where(cls, **kwargs) -> list:
+        """
+        predicates always added for this cmd with the given run args, see --where
+        """
+        return []
+
+    @classmethod
+    def summary(cls, items):
+        """
+        called once after all repos finished, items are finished repos' config
+        """
+        pass
+
+    def clone_options(self) -> dict:
+        """
+        git clone options from config:
+        depth: shallow clone depth, filter: partial clone filter(blob:none/tree:0),
+        single_branch: only fetch one branch, sparse: sparse-checkout cone dirs
+        """
+        options = {}
+        recursive = self.value_or_default("recursive", True)
+        depth = self.value_or_default("depth", None)
+        clone_filter = self.value_or_default("filter", None)
+        if recursive:
+            options["recurse_submodules"] = True
+        if depth:
+            options["depth"] = int(depth)
+            if recursive:
+                options["shallow_submodules"] = True
+        if clone_filter:
+            options["filter"] = clone_filter
+            if recursive:
+                options["also_filter_submodules"] = True
+        if self.value_or_default("single_branch", False):
+            options["single_branch"] = True
+        if self.sparse_patterns():
+            options["sparse"] = True
+        return options
+
+    def sparse_patterns(self) -> list:
+        sparse = self.value_or_default("sparse", None) or []
+        if isinstance(sparse, str):
+            sparse = [sparse]
+        return sparse
+
+    def apply_sparse_cmd(self) -> str:
+        """
+        cmd to (re)apply sparse-checkout patterns, "" if not sparse
+        """
+        sparse = self.sparse_patterns()
+        if len(sparse) == 0:
+            return ""
+        return "git sparse-checkout set --cone " + " ".join(sparse)
+
     def is_dirty(self):
         if self.repository is not None:
             return self.repository.is_dirty()
@@ -412,6 +2012,7 @@ class CmdBase:
 
 # ---------- repositories mng  ----------
 
+@register_cmd
 class TestCmd(CmdBase):
     cmd = "test"
     description = "test cmd args, just print input"
@@ -426,10 +2027,14 @@ class TestCmd(CmdBase):
         return 0, "", ""
 
 
+@register_cmd
 class GitCloneCmd(CmdBase):
     cmd = "clone"
     description = "clone repositories in config"
     help = description
+    workload = "network"
+    # size/time of full clones, to report what shallow/partial clone saved
+    CLONE_STATS_FILE = ".repm/clone_stats.json"
 
     def run(self, category: str = "", project: str = ""):
         """
@@ -443,74 +2048,358 @@ class GitCloneCmd(CmdBase):
             cmd_logger.info(f"ignore by project filter {project} != {self.name}")
             return 0, "", ""
         local_path = self.value("local")
-        if (self.base_path / local_path).exists():
-            cmd_logger.debug(f"ignore exists {self.name} {local_path}")
+        if self.repo_path.exists():
+            cmd_logger.debug("ignore exists %s %s", self.name, local_path)
             return 0, "", "ignore exists"
-        recursive = self.value_or_default("recursive", True)
+        if "worktree_of" in self.curr_conf:
+            return self.add_worktree()
         remote_path = self.value("remote")
+        options = self.clone_options()
         cmd_logger.info(f"will clone {remote_path} into {local_path}")
         try:
-            repo.Repo.clone_from(remote_path, local_path, recursive=recursive)
+            begin = time.time()
+            repo.Repo.clone_from(remote_path, self.repo_path, **options).close()
+            if self.apply_sparse_cmd() != "":
+                ret, _, stderr = run_command(self.apply_sparse_cmd(), cwd=self.repo_path)
+                if ret != 0:
+                    cmd_logger.error(f"fail | {self.name} | sparse-checkout {stderr.strip()}")
+                    return ret, "", stderr
+            self.curr_conf["clone_stats"] = {
+                "mode": self.clone_mode(options),
+                "bytes": dir_size(resolve_git_dir(self.repo_path)),
+                "seconds": time.time() - begin,
+            }
             cmd_logger.info(f"end | {self.name}")
             return 0, "", ""
         except Exception as e:
             cmd_logger.error(f"fail | {self.name}")
             return -1, "", f"clone fail {self.name} {local_path} {remote_path} {e}"
 
+    def add_worktree(self):
+        """
+        git worktree add on the main clone instead of another clone, objects are shared
+        """
+        main_path = self.base_path / self.curr_conf["worktree_of"]
+        branch = self.value("branch")
+        if not main_path.exists():
+            return -1, "", f"main repo of worktree not cloned {main_path}"
+        cmd_logger.info(f"will add worktree {branch} of {self.curr_conf['worktree_of']} into {self.value('local')}")
+        # worktrees of one repo write the same config/shallow/worktrees files, add them one by one
+        with host_limiter.slot(f"worktree:{main_path}", 1):
+            for cmd in self.add_worktree_cmds(main_path, branch):
+                ret, _, stderr = run_command(cmd, cwd=main_path)
+                if ret != 0:
+                    cmd_logger.error(f"fail | {self.name} | {' '.join(cmd)} {stderr.strip()}")
+                    return ret, "", stderr
+        after = []
+        if self.value_or_default("recursive", True):
+            after.append("git submodule update --init --recursive")
+        if self.apply_sparse_cmd() != "":
+            after.append(self.apply_sparse_cmd())
+        for cmd in after:
+            ret, _, stderr = run_command(cmd, cwd=self.repo_path)
+            if ret != 0:
+                cmd_logger.error(f"fail | {self.name} | {cmd} {stderr.strip()}")
+                return ret, "", stderr
+        cmd_logger.info(f"end | {self.name}")
+        return 0, "", ""
+
+    def add_worktree_cmds(self, main_path: pathlib.Path, branch: str) -> list:
+        cmds = []
+        ret, _, _ = run_command(["git", "rev-parse", "--verify", "-q", f"refs/remotes/origin/{branch}"], cwd=main_path)
+        if ret != 0:
+            # single_branch clone, also track this branch so fetch of the main repo updates it
+            refspec = f"+refs/heads/{branch}:refs/remotes/origin/{branch}"
+            _, refspecs, _ = run_command(["git", "config", "--get-all", "remote.origin.fetch"], cwd=main_path)
+            if refspec not in refspecs.split():
+                cmds.append(["git", "config", "--add", "remote.origin.fetch", refspec])
+            fetch = ["git", "fetch", "origin", refspec]
+            depth = self.value_or_default("depth", None)
+            if depth:
+                fetch.insert(2, f"--depth={int(depth)}")
+            cmds.append(fetch)
+        ret, _, _ = run_command(["git", "rev-parse", "--verify", "-q", f"refs/heads/{branch}"], cwd=main_path)
+        if ret == 0:
+            cmds.append(["git", "worktree", "add", str(self.repo_path), branch])
+        else:
+            cmds.append(["git", "worktree", "add", "--track", "-b", branch, str(self.repo_path), f"origin/{branch}"])
+        return cmds
 
+    @staticmethod
+    def clone_mode(options: dict) -> str:
+        modes = []
+        if "depth" in options:
+            modes.append(f"depth={options['depth']}")
+        if "filter" in options:
+            modes.append(f"filter={options['filter']}")
+        if "single_branch" in options:
+            modes.append("single_branch")
+        if "sparse" in options:
+            modes.append("sparse")
+        return ",".join(modes) or "full"
+
+    @classmethod
+    def summary(cls, items):
+        """
+        print bytes/time of each clone, and saved compared with full clone recorded before
+        """
+        # full clones first, so reduced ones in the same run compare with them
+        cloned = sorted([item for item in items if "clone_stats" in item],
+                        key=lambda item: item["clone_stats"]["mode"] != "full")
+        if len(cloned) == 0:
+            return
+        stats_files = {}
+        saved_bytes = 0
+        saved_seconds = 0
+        for item in cloned:
+            stats_file = item["workspace"].base_path / cls.CLONE_STATS_FILE
+            if stats_file not in stats_files:
+                stats_files[stats_file] = load_json(stats_file, {})
+            full_stats = stats_files[stats_file]
+            curr = item["clone_stats"]
+            key = normalize_remote(item["remote"])
+            line = f"  {item['name']} | {curr['mode']} | {curr['bytes'] / 1024 / 1024:.1f}MB {curr['seconds']:.1f}s"
+            if curr["mode"] == "full":
+                full_stats[key] = curr
+            elif key in full_stats:
+                bytes_diff = full_stats[key]["bytes"] - curr["bytes"]
+                seconds_diff = full_stats[key]["seconds"] - curr["seconds"]
+                saved_bytes += bytes_diff
+                saved_seconds += seconds_diff
+                line += f" | saved {bytes_diff / 1024 / 1024:.1f}MB {seconds_diff:.1f}s vs full clone"
+            cmd_logger.info(line)
+        for stats_file, full_stats in stats_files.items():
+            save_json(stats_file, full_stats)
+        if saved_bytes or saved_seconds:
+            cmd_logger.info(f"clone saved {saved_bytes / 1024 / 1024:.1f}MB {saved_seconds:.1f}s "
+                            f"vs recorded full clones")
+
+
+@register_cmd
 class GitAnyCmd(CmdBase):
     cmd = "cmd"
     description = "run any cmd in each repository's dir"
     help = description
+    CMD_CACHE_DIR = ".repm/cmd_cache"
 
-    def run(self, cmd: str):
+    def run(self, cmd: str, cache: bool = False, cache_env: str = ""):
         """
         :param cmd : any
+        :param cache : replay saved exit code and output if HEAD, uncommitted/untracked files and cache env not changed
+        :param cache_env : comma separated env vars in cache key, added to global_config.cmd_cache_env
         """
-        return self.execute_cmd_in_rep_dir(cmd)
+        if not cache or self.repository is None:
+            return self.execute_cmd_in_rep_dir(cmd)
+        env_names = self.value_or_default("cmd_cache_env", None) or []
+        if isinstance(env_names, str):
+            env_names = env_names.split(",")
+        env_names = sorted({name for name in env_names + cache_env.split(",") if name != ""})
+        cache_size = int(self.value_or_default("cmd_cache_mb", None) or 64) * 1024 * 1024
+        result_cache = ResultCache(self.base_path / self.CMD_CACHE_DIR, cache_size)
+        key = self.cache_key(cmd, env_names)
+        if key is not None:
+            cached = result_cache.get(key)
+            if cached is not None:
+                cmd_logger.info(f"cached | {self.name} | {cmd} | ret {cached['ret']}")
+                # same output log as a real run, see execute_cmd_in_rep_dir
+                cmd_logger.debug("exec | %s | %s | %s\n%s%s", self.name, cmd, cached["ret"], cached["stdout"],
+                                 cached["stderr"])
+                self.curr_conf["cmd_cached"] = True
+                return cached["ret"], cached["stdout"], cached["stderr"]
+        ret, stdout, stderr = self.execute_cmd_in_rep_dir(cmd)
+        self.curr_conf["cmd_cached"] = False
+        # -1 is timeout, may pass next time
+        if ret == -1:
+            return ret, stdout, stderr
+        result = {"ret": ret, "stdout": stdout, "stderr": stderr}
+        if key is not None:
+            result_cache.put(key, result)
+        # cmd changed files(codegen, format), also save for the state it left, next run is a hit
+        after = self.cache_key(cmd, env_names)
+        if after is not None and after != key:
+            result_cache.put(after, result)
+        return ret, stdout, stderr
+
+    def cache_key(self, cmd: str, env_names: list):
+        """
+        result only depends on cmd, checked out files and env: HEAD sha, uncommitted/untracked changes, env values
+        """
+        sha = read_head_sha(self.repo_path)
+        fingerprint = worktree_fingerprint(self.repo_path, untracked=True)
+        if sha is None or fingerprint is None:
+            return None
+        env = [f"{name}={os.environ.get(name, None)}" for name in env_names]
+        return ResultCache.key("cmd", self.repo_path, cmd, sha, fingerprint, *env)
+
+    @classmethod
+    def summary(cls, items):
+        """
+        report cache hits, keep cache under global_config.cmd_cache_mb(default 64)
+        """
+        cached = [item["cmd_cached"] for item in items if "cmd_cached" in item]
+        if len(cached) == 0:
+            return
+        cmd_logger.info(f"cmd cache | hit:{sum(cached)} miss:{len(cached) - sum(cached)}")
+        for workspace in {item["workspace"] for item in items}:
+            cache_size = int(workspace.global_conf.get("cmd_cache_mb", None) or 64) * 1024 * 1024
+            ResultCache(workspace.base_path / cls.CMD_CACHE_DIR, cache_size).evict()
+
+
+@register_cmd
+class GitPrefetchCmd(CmdBase):
+    cmd = "prefetch"
+    description = "fetch repositories into refs/prefetch/ in background, then 'update --prefetched' is local only"
+    help = description
+    workload = "network"
+    # refs are shared, fetched once by the main repo
+    worktrees = False
+    # same namespace as git maintenance's prefetch task
+    PREFETCH_REF = "refs/prefetch/remotes/origin"
 
+    @staticmethod
+    def run_cmd(cls, interval: int = 0):
+        while True:
+            begin = time.time()
+            runner.create_and_run_cmd(cls, interval=interval)
+            if interval <= 0:
+                break
+            cmd_logger.info(f"prefetch cost {time.time() - begin:.1f}s, next in {interval}s")
+            time.sleep(interval)
 
+    def run(self, interval: int = 0):
+        """
+        :param interval : seconds between two prefetch rounds, 0 means only once
+        """
+        if self.repository is None:
+            return 0, "", ""
+        host = remote_host(self.value("remote"))
+        per_host = self.value_or_default("prefetch_per_host", 4)
+        branch = "*"
+        if self.value_or_default("depth", None):
+            # no --depth, a grafted tip could not be fast-forwarded to, see update,
+            # and only current branch, other branches' full history would be fetched
+            branch = read_head_branch(self.repo_path)
+            if branch in (None, "HEAD"):
+                cmd_logger.debug("prefetch skip detached shallow repo | %s", self.name)
+                return 0, "", ""
+        cmd = low_priority_prefix() + ["git", "fetch", "origin", "--prune", "--no-tags", "--no-write-fetch-head",
+                                       "--quiet", f"+refs/heads/{branch}:{self.PREFETCH_REF}/{branch}"]
+        with host_limiter.slot(host, per_host):
+            cmd_logger.debug("prefetch | %s | %s", self.name, host)
+            ret, stdout, stderr = run_command(cmd, cwd=self.repo_path)
+        if ret != 0:
+            cmd_logger.error(f"prefetch fail | {self.name} | {stderr.strip()}")
+        return ret, stdout, stderr
+
+
+@register_cmd
 class GitUpdateCmd(CmdBase):
     cmd = "update"
     description = "update repositories in config"
     help = description
+    workload = "network"
 
-    def run(self, ignore_sub: bool = False):
+    def run(self, ignore_sub: bool = False, prefetched: bool = False):
         """
         :param ignore_sub : ignore update sub module
+        :param prefetched : fast-forward from refs fetched by prefetch, no network unless ref missing
         """
+        if prefetched:
+            ret = self.fast_forward_prefetched(ignore_sub)
+            if ret is not None:
+                return ret
         recursive_str = " --recurse-submodules"
         if ignore_sub:
             recursive_str = ""
-        return self.execute_cmd_in_rep_dir(f'git pull {recursive_str}')
+        depth = self.value_or_default("depth", None)
+        clone_filter = self.value_or_default("filter", None)
+        worktree = "worktree_of" in self.curr_conf
+        if worktree:
+            # remote refs are shared, fetched by the main repo which runs first by depends_on
+            cmd = "git merge --ff-only @{upstream}"
+        else:
+            # no --depth even for shallow repos: --depth grafts the new tip so it has no merge base with HEAD,
+            # a plain fetch connects new commits to the shallow boundary, merge works and local commits are kept
+            cmd = f'git pull {recursive_str}'
+        if not ignore_sub and (depth or clone_filter or worktree):
+            # keep submodules shallow/partial as clone did
+            cmd += " && git submodule update --init --recursive"
+            if depth:
+                cmd += f" --depth {int(depth)}"
+            if clone_filter:
+                cmd += f" --filter={clone_filter}"
+        if self.apply_sparse_cmd() != "":
+            cmd += " && " + self.apply_sparse_cmd()
+        return self.execute_cmd_in_rep_dir(cmd)
 
+    @classmethod
+    def summary(cls, items):
+        # keep commit index up to date if it is used
+        index = CommitIndex(runner.base_path)
+        if index.exists():
+            index.update([item for item in items if "worktree_of" not in item], cls.jobs_num)
 
+    def fast_forward_prefetched(self, ignore_sub: bool):
+        """
+        merge --ff-only from prefetch ref, None if no prefetch ref for current branch
+        """
+        if self.repository is None:
+            return 0, "", ""
+        ret, branch, _ = run_command(["git", "symbolic-ref", "--short", "-q", "HEAD"], cwd=self.repo_path)
+        if ret != 0:
+            return None
+        prefetch_ref = f"{GitPrefetchCmd.PREFETCH_REF}/{branch.strip()}"
+        ret, _, _ = run_command(["git", "rev-parse", "--verify", "-q", prefetch_ref], cwd=self.repo_path)
+        if ret != 0:
+            cmd_logger.info(f"no prefetch ref, fallback to pull | {self.name} | {prefetch_ref}")
+            return None
+        cmd = f"git merge --ff-only {prefetch_ref}"
+        if not ignore_sub:
+            cmd += " && git submodule update --init --recursive"
+        if self.apply_sparse_cmd() != "":
+            cmd += " && " + self.apply_sparse_cmd()
+        return self.execute_cmd_in_rep_dir(cmd)
+
+
+@register_cmd
 class GitCommitAllCmd(CmdBase):
     cmd = "commit_all"
     description = "commit all change to remote"
     help = description
+    workload = "network"
+
+    @classmethod
+    def implicit_where(cls, m="batch update", f=True) -> list:
+        # not force: only dirty repos, checked before dispatch
+        if not f:
+            return ["dirty"]
+        return []
 
     def run(self, m="batch update", f=True):
         """
         :param m : commit message
         :param f : force commit
         """
-        if not f and not self.is_dirty():
-            return 0, "", ""
         logger.info(f"will commit {self.name}")
         return self.execute_cmd_in_rep_dir(f'git add . && git commit -m "{m}" && git push')
 
 
+@register_cmd
 class GitCheckoutCmd(CmdBase):
     cmd = "checkout"
     description = "recursive update repositories in config"
     help = description
+    workload = "network"
 
     def run(self, branch: str, r: bool = False):
         """
         :param branch : specified branch
         :param r : recurse submodule
         """
+        if "worktree_of" in self.curr_conf and self.value("branch") != branch:
+            # a worktree keeps its configured branch, git refuses a branch checked out in another worktree
+            cmd_logger.debug("skip worktree | %s | on %s", self.name, self.value("branch"))
+            return 0, "", ""
         #  git -c credential.helper= pull --recurse-submodules --progress origin better_game
         cmd = f'git checkout {branch} && git pull '
         if r:
@@ -518,10 +2407,12 @@ class GitCheckoutCmd(CmdBase):
         return self.execute_cmd_in_rep_dir(cmd)
 
 
+@register_cmd
 class GitStatusCmd(CmdBase):
     cmd = "status"
     description = "recursive update repositories in config"
     help = description
+    workload = "disk"
     jobs_num = 1
 
     def run(self, r: bool = False, q=True):
@@ -542,10 +2433,12 @@ class GitStatusCmd(CmdBase):
         return status, stdout, stderr
 
 
+@register_cmd
 class GitConfUserCmd(CmdBase):
     cmd = "user"
     description = "set user's name and email"
     help = description
+    workload = "disk"
 
     def run(self, user_name: str, email: str, r: bool = False):
         """
@@ -561,6 +2454,758 @@ class GitConfUserCmd(CmdBase):
         return ret
 
 
+
+@register_cmd
+class GitSyncCmd(CmdBase):
+    cmd = "sync"
+    description = "reconcile disk with config: clone new, move renamed, set-url changed, report or archive removed"
+    help = description
+    workload = "network"
+    ARCHIVE_DIR = ".repm/archive"
+
+    @staticmethod
+    def run_cmd(cls, archive: bool = False, dry_run: bool = False):
+        workspaces = runner.load_workspaces()
+        delta = []
+        for workspace in workspaces:
+            # included workspaces are synced by themselves
+            exclude = [other.base_path for other in workspaces if other is not workspace]
+            delta += GitSyncCmd.diff(workspace, exclude)
+        if dry_run or len(delta) == 0:
+            return
+        jobs = runner.make_jobs(cls, workspaces[0].global_conf)
+        # worktrees link to their main repo by absolute paths: move main repos first(repaired after move),
+        # then remove old worktrees so their branches are free, then add new worktrees
+        phases = [[], [], []]
+        for item in delta:
+            if "worktree_of" in item:
+                phases[2].append(item)
+            elif item.get("sync_worktree", False):
+                phases[1].append(item)
+            else:
+                phases[0].append(item)
+        results = ([], [], [])
+        for phase in phases:
+            if len(phase) > 0:
+                for items, part in zip(results, runner.execute(cls, phase, jobs, archive=archive, dry_run=dry_run)):
+                    items += part
+        return results
+
+    @staticmethod
+    def diff(workspace, exclude=()):
+        """
+        compare config with repos on disk, return items need to change with sync_action set
+        """
+        base_path = workspace.base_path
+        need_exec = workspace.repos()
+        max_depth = max([len(pathlib.PurePosixPath(item["local"]).parts) for item in need_exec] + [2])
+        on_disk = scan_git_repos(base_path, max_depth, exclude)
+        wanted = {item["local"] for item in need_exec}
+        worktrees = {local for local in on_disk if is_worktree(base_path / local)}
+        # repos on disk but not in config, can be the source of a move, worktrees only have a link to their repo
+        orphans = {}
+        for local, url in on_disk.items():
+            if local not in wanted and local not in worktrees and url is not None:
+                orphans.setdefault(normalize_remote(url), []).append(local)
+
+        delta = []
+        unchanged = 0
+        for item in need_exec:
+            item = dict(item)
+            local = item["local"]
+            remote = item.get("remote", None)
+            if local in on_disk:
+                url = on_disk[local]
+                if remote is None or (url is not None and normalize_remote(url) == normalize_remote(remote)):
+                    unchanged += 1
+                    continue
+                item["sync_action"] = "set_url"
+                item["sync_from"] = url
+            elif (base_path / local).exists():
+                cmd_logger.error(f"sync conflict | {item['name']} | {local} exists but not a git repo")
+                continue
+            elif "worktree_of" not in item and remote is not None and orphans.get(normalize_remote(remote), None):
+                item["sync_action"] = "move"
+                item["sync_from"] = orphans[normalize_remote(remote)].pop(0)
+            else:
+                item["sync_action"] = "clone"
+            delta.append(item)
+
+        moved = {item["sync_from"] for item in delta if item["sync_action"] == "move"}
+        for local, url in sorted(on_disk.items()):
+            if local in wanted or local in moved:
+                continue
+            delta.append({"name": local, "category": "", "local": local, "remote": url, "sync_action": "remove",
+                          "sync_worktree": local in worktrees, "workspace": workspace})
+
+        counter = collections.Counter(item["sync_action"] for item in delta)
+        counts = " ".join(f"{k}:{v}" for k, v in sorted(counter.items()))
+        cmd_logger.info(f"sync {workspace.name} | unchanged:{unchanged} {counts}")
+        for item in delta:
+            if item["sync_action"] == "clone":
+                cmd_logger.info(f"  clone | {item['local']} <- {item['remote']}")
+            else:
+                cmd_logger.info(f"  {item['sync_action']} | {item['local']} | {item.get('sync_from', None) or ''}")
+        return delta
+
+    def run(self, archive: bool = False, dry_run: bool = False):
+        """
+        :param archive : move repos removed from config into .repm/archive, default only report them
+        :param dry_run : only print the difference
+        """
+        action = self.curr_conf["sync_action"]
+        if action == "clone":
+            return GitCloneCmd(self.global_conf, self.curr_conf, self.base_path).run()
+        if action == "set_url":
+            return self.execute_cmd_in_rep_dir(f"git remote set-url origin {self.value('remote')}")
+        if action == "move":
+            src = self.base_path / self.curr_conf["sync_from"]
+            cmd_logger.info(f"move | {self.name} | {src} -> {self.repo_path}")
+            self.repo_path.parent.mkdir(parents=True, exist_ok=True)
+            shutil.move(str(src), str(self.repo_path))
+            if (resolve_git_dir(self.repo_path) / "worktrees").is_dir():
+                # worktrees' .git files point to the old path
+                return self.execute_cmd_in_rep_dir("git worktree repair && git worktree prune")
+            return 0, "", ""
+        if action == "remove":
+            if not archive:
+                cmd_logger.info(f"not in config | {self.name}, add --archive to archive it")
+                return 0, "", ""
+            if is_worktree(self.repo_path):
+                # worktree has no data of its own, remove it from its main repo, refused if it has changes
+                cmd_logger.info(f"remove worktree | {self.name}")
+                common_dir = common_git_dir(resolve_git_dir(self.repo_path))
+                ret, stdout, stderr = run_command(["git", "worktree", "remove", str(self.repo_path)], cwd=common_dir)
+                if ret == 0:
+                    run_command(["git", "worktree", "prune"], cwd=common_dir)
+                return ret, stdout, stderr
+            dst = self.base_path / self.ARCHIVE_DIR / time.strftime("%Y%m%d_%H%M%S") / self.value("local")
+            cmd_logger.info(f"archive | {self.name} -> {dst}")
+            dst.parent.mkdir(parents=True, exist_ok=True)
+            shutil.move(str(self.repo_path), str(dst))
+            return 0, "", ""
+        raise ValueError(f"unknown sync action {action}")
+
+
+@register_cmd
+class GitStatsCmd(CmdBase):
+    cmd = "stats"
+    description = "disk size, packs, files, loc by language and largest blobs of each repository"
+    help = description
+    workload = "cpu"
+    # objects are shared, counted once by the main repo
+    worktrees = False
+    use_progress = False
+    # {local: {"head": sha, "top": n, "stats": {}}}, repo rescanned only when HEAD changed
+    STATS_CACHE_FILE = ".repm/stats_cache.json"
+
+    @staticmethod
+    def run_cmd(cls, top: int = 10, no_cache: bool = False):
+        global_conf, need_exec = runner.load_config(cls.worktrees)
+        need_exec = runner.select_by_where(need_exec)
+        jobs = global_conf.get("jobs", None)
+        if not isinstance(jobs, int):
+            jobs = cls.jobs_num
+        caches = {}
+        results = {}
+        todo = []
+        for item in need_exec:
+            path = item["workspace"].base_path / item["local"]
+            head = read_head_sha(path)
+            if head is None:
+                continue
+            cache_file = item["workspace"].base_path / cls.STATS_CACHE_FILE
+            if cache_file not in caches:
+                caches[cache_file] = {} if no_cache else load_json(cache_file, {})
+            cached = caches[cache_file].get(item["local"], None)
+            if cached and cached["head"] == head and cached["top"] >= top:
+                results[id(item)] = cached["stats"]
+            else:
+                todo.append((item, path, head, cache_file))
+        cmd_logger.info(f"stats | {len(todo)} to scan, {len(results)} cached, jobs {jobs}")
+
+        # scan in processes, reading packs and counting lines is cpu bound
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+            tasks = {executor.submit(scan_repo_stats, str(path), top): (item, head, cache_file)
+                     for item, path, head, cache_file in todo}
+            for fu in concurrent.futures.as_completed(tasks):
+                item, head, cache_file = tasks[fu]
+                try:
+                    stats = fu.result()
+                except Exception as e:
+                    cmd_logger.error(f"fail | {item['name']} | {e!r}")
+                    continue
+                results[id(item)] = stats
+                caches[cache_file][item["local"]] = {"head": head, "top": top, "stats": stats}
+        for cache_file, cache in caches.items():
+            save_json(cache_file, cache)
+        cls.print_stats([(item, results[id(item)]) for item in need_exec if id(item) in results], top)
+
+    @staticmethod
+    def print_stats(all_stats, top: int):
+        def mb(n):
+            return f"{n / 1024 / 1024:.1f}MB"
+
+        all_stats = sorted(all_stats, key=lambda x: x[1]["pack_bytes"] + x[1]["loose_bytes"], reverse=True)
+        total_loc = collections.Counter()
+        largest = []
+        for item, stats in all_stats:
+            loc = collections.Counter(stats["loc"])
+            total_loc.update(loc)
+            langs = ", ".join(f"{lang}:{lines}" for lang, lines in loc.most_common(3))
+            cmd_logger.info(f"{item['local']} | objects {mb(stats['pack_bytes'] + stats['loose_bytes'])} "
+                            f"({stats['packs']} packs, {stats['loose']} loose) | "
+                            f"files {stats['files']} {mb(stats['tree_bytes'])} | loc {sum(loc.values())} {langs}")
+            largest += [(blob["size"], blob["sha"], item["local"]) for blob in stats["largest"]]
+        total_objects = sum(stats["pack_bytes"] + stats["loose_bytes"] for _, stats in all_stats)
+        cmd_logger.info(f"total | {len(all_stats)} repos | objects {mb(total_objects)} | "
+                        f"loc {sum(total_loc.values())} " + ", ".join(f"{k}:{v}" for k, v in total_loc.most_common(5)))
+        if len(largest) > 0:
+            cmd_logger.info("largest blobs:")
+            for size, sha, local in sorted(largest, reverse=True)[:top]:
+                cmd_logger.info(f"  {mb(size)} | {local} | {sha}")
+
+    def run(self, top: int = 10, no_cache: bool = False):
+        """
+        :param top : number of largest blobs to show
+        :param no_cache : rescan all repos even HEAD not changed
+        """
+        return 0, "", ""
+
+
+@register_cmd
+class GitGrepCmd(CmdBase):
+    cmd = "grep"
+    description = "git grep tracked files in all repositories in parallel, print matches as they come"
+    help = description
+    workload = "disk"
+    use_progress = False
+    GREP_CACHE_DIR = ".repm/grep_cache"
+
+    @staticmethod
+    def run_cmd(cls, pattern: str, rev: str = "", max_count: int = 0, i: bool = False, no_cache: bool = False):
+        global_conf, need_exec = runner.load_config(cls.worktrees)
+        need_exec = runner.select_by_where(need_exec)
+        jobs = global_conf.get("jobs", None)
+        if not isinstance(jobs, int):
+            jobs = cls.jobs_num
+        cache_size = int(global_conf.get("grep_cache_mb", None) or 64) * 1024 * 1024
+        begin = time.time()
+        output = queue.Queue()
+        stop = threading.Event()
+        options = ["-n", "-I", "-z", "--no-color"] + (["-i"] if i else [])
+        # None marks one repo finished
+        done_marker = None
+
+        def grep_one(item):
+            path = item["workspace"].base_path / item["local"]
+            cache = ResultCache(item["workspace"].base_path / cls.GREP_CACHE_DIR, cache_size)
+            try:
+                if stop.is_set() or read_head_sha(path) is None:
+                    return "skip"
+                key = None
+                if not no_cache:
+                    key = cls.cache_key(path, pattern, options, rev)
+                prefix = item["workspace"].display_path(item["local"])
+                if key is not None:
+                    cached = cache.get(key)
+                    if cached is not None:
+                        for line in cached:
+                            output.put(f"{prefix}/{line}")
+                        return "cached"
+                lines = []
+                cmd = ["git", "-c", "core.quotepath=off", "grep"] + options + ["-e", pattern]
+                if rev != "":
+                    cmd.append(rev)
+                cmd.append("--")
+                process = subprocess.Popen(cmd, cwd=path, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                           text=True, errors="replace")
+                for raw in process.stdout:
+                    if stop.is_set():
+                        process.kill()
+                        break
+                    parts = raw.rstrip("\n").split("\0", 2)
+                    if len(parts) != 3:
+                        continue
+                    file, line_no, text = parts
+                    if rev != "" and file.startswith(f"{rev}:"):
+                        file = file[len(rev) + 1:]
+                    line = f"{file}:{line_no}:{text}"
+                    lines.append(line)
+                    output.put(f"{prefix}/{line}")
+                process.wait()
+                if key is not None and not stop.is_set() and process.returncode in (0, 1):
+                    cache.put(key, lines)
+                return "searched"
+            finally:
+                output.put(done_marker)
+
+        matches = 0
+        counter = collections.Counter()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+            tasks = [executor.submit(grep_one, item) for item in need_exec]
+            left = len(tasks)
+            while left > 0:
+                line = output.get()
+                if line is done_marker:
+                    left -= 1
+                    continue
+                if stop.is_set():
+                    continue
+                print(line)
+                matches += 1
+                if 0 < max_count <= matches:
+                    stop.set()
+            for fu in tasks:
+                try:
+                    counter[fu.result()] += 1
+                except Exception as e:
+                    counter["fail"] += 1
+                    cmd_logger.error(f"grep fail | {e!r}")
+        sys.stdout.flush()
+        for cache_dir in {item["workspace"].base_path / cls.GREP_CACHE_DIR for item in need_exec}:
+            ResultCache(cache_dir, cache_size).evict()
+        info = " ".join(f"{k}:{v}" for k, v in sorted(counter.items()))
+        cmd_logger.info(f"grep | {matches} matches{' (stopped at max_count)' if stop.is_set() else ''} | "
+                        f"{info} | {time.time() - begin:.2f}s")
+
+    @staticmethod
+    def cache_key(path, pattern: str, options: list, rev: str):
+        """
+        grep result only depends on the searched tree: sha of rev, or HEAD plus uncommitted changes
+        """
+        if rev != "":
+            ret, sha, _ = run_command(["git", "rev-parse", "--verify", "-q", f"{rev}^{{tree}}"], cwd=path)
+            if ret != 0:
+                return None
+            return ResultCache.key("grep", path, pattern, *options, rev, sha.strip())
+        fingerprint = worktree_fingerprint(path)
+        if fingerprint is None:
+            return None
+        return ResultCache.key("grep", path, pattern, *options, read_head_sha(path), fingerprint)
+
+    def run(self, pattern: str, rev: str = "", max_count: int = 0, i: bool = False, no_cache: bool = False):
+        """
+        :param pattern : regex passed to git grep -e
+        :param rev : search this revision instead of work tree
+        :param max_count : stop after this many matches in total, 0 is no limit
+        :param i : ignore case
+        :param no_cache : not read or write result cache
+        """
+        return 0, "", ""
+
+
+class CommitIndex:
+    """
+    sqlite index of commits(repo, sha, author, date, subject, touched paths) of all repos' HEAD history
+    updated incrementally from the last indexed tip of each repo
+    """
+    INDEX_FILE = ".repm/index.sqlite"
+    LOG_FORMAT = "%x1e%H%x1f%an%x1f%ae%x1f%at%x1f%s"
+
+    def __init__(self, base_path):
+        self.path = pathlib.Path(base_path) / self.INDEX_FILE
+
+    def exists(self) -> bool:
+        return self.path.is_file()
+
+    def connect(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(self.path)
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS commits(repo TEXT, sha TEXT, author TEXT, email TEXT, date INTEGER,
+                                               subject TEXT, PRIMARY KEY(repo, sha));
+            CREATE INDEX IF NOT EXISTS commits_date ON commits(date);
+            CREATE TABLE IF NOT EXISTS paths(repo TEXT, sha TEXT, path TEXT);
+            CREATE INDEX IF NOT EXISTS paths_path ON paths(path);
+            CREATE INDEX IF NOT EXISTS paths_commit ON paths(repo, sha);
+            CREATE TABLE IF NOT EXISTS tips(repo TEXT PRIMARY KEY, sha TEXT);
+        """)
+        return conn
+
+    @classmethod
+    def read_commits(cls, path, tip, head):
+        """
+        commits from tip(excluded) to head, all history if tip is None or not an ancestor(history rewritten)
+        :return: (full, [(sha, author, email, date, subject, [paths])])
+        """
+        full = tip is None
+        if not full:
+            ret, _, _ = run_command(["git", "merge-base", "--is-ancestor", tip, head], cwd=path)
+            full = ret != 0
+        commit_range = head if full else f"{tip}..{head}"
+        ret, stdout, stderr = run_command(["git", "-c", "core.quotepath=off", "log", f"--format={cls.LOG_FORMAT}",
+                                           "--name-only", "--no-renames", commit_range, "--"], cwd=path)
+        if ret != 0:
+            raise RuntimeError(stderr.strip())
+        commits = []
+        for record in stdout.split("\x1e")[1:]:
+            header, _, names = record.partition("\n")
+            sha, author, email, date, subject = header.split("\x1f", 4)
+            paths = [name for name in names.splitlines() if name != ""]
+            commits.append((sha, author, email, int(date), subject, paths))
+        return full, commits
+
+    def update(self, need_exec, jobs: int, rebuild: bool = False):
+        """
+        index new commits of need_exec, git log runs in threads, writes in this thread
+        """
+        begin = time.time()
+        conn = self.connect()
+        if rebuild:
+            conn.execute("DELETE FROM tips")
+        tips = dict(conn.execute("SELECT repo, sha FROM tips"))
+        todo = []
+        for item in need_exec:
+            path = item["workspace"].base_path / item["local"]
+            head = read_head_sha(path)
+            name = item["workspace"].display_path(item["local"])
+            if head is not None and tips.get(name, None) != head:
+                todo.append((name, path, head))
+        added = 0
+        with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+            tasks = {executor.submit(self.read_commits, path, tips.get(name, None), head): (name, head)
+                     for name, path, head in todo}
+            for fu in concurrent.futures.as_completed(tasks):
+                name, head = tasks[fu]
+                try:
+                    full, commits = fu.result()
+                except Exception as e:
+                    cmd_logger.error(f"index fail | {name} | {e}")
+                    continue
+                with conn:
+                    if full:
+                        conn.execute("DELETE FROM commits WHERE repo = ?", (name,))
+                        conn.execute("DELETE FROM paths WHERE repo = ?", (name,))
+                    conn.executemany("INSERT OR REPLACE INTO commits VALUES(?, ?, ?, ?, ?, ?)",
+                                     [(name,) + commit[:5] for commit in commits])
+                    conn.executemany("INSERT INTO paths VALUES(?, ?, ?)",
+                                     [(name, commit[0], path) for commit in commits for path in commit[5]])
+                    conn.execute("INSERT OR REPLACE INTO tips VALUES(?, ?)", (name, head))
+                added += len(commits)
+        conn.close()
+        cmd_logger.info(f"index | {len(todo)} repos changed, {added} commits added | {time.time() - begin:.2f}s")
+
+    def query(self, since=None, until=None, author="", path="", repo="", limit=50):
+        conn = self.connect()
+        sql = "SELECT date, repo, sha, author, subject FROM commits c WHERE 1 = 1"
+        params = []
+        if since is not None:
+            sql += " AND date >= ?"
+            params.append(since)
+        if until is not None:
+            sql += " AND date < ?"
+            params.append(until)
+        if author != "":
+            sql += " AND (author LIKE ? OR email LIKE ?)"
+            params += [f"%{author}%", f"%{author}%"]
+        if repo != "":
+            sql += " AND repo LIKE ?"
+            params.append(f"%{repo}%")
+        if path != "":
+            # file itself or anything under the dir, range keeps the index usable
+            path = path.rstrip("/")
+            sql += (" AND EXISTS (SELECT 1 FROM paths p WHERE p.repo = c.repo AND p.sha = c.sha"
+                    " AND (p.path = ? OR (p.path >= ? AND p.path < ?)))")
+            params += [path, f"{path}/", f"{path}0"]
+        # same second: git log order, newest inserted first
+        sql += " ORDER BY date DESC, rowid ASC LIMIT ?"
+        params.append(limit)
+        rows = conn.execute(sql, params).fetchall()
+        conn.close()
+        return rows
+
+
+def parse_time(value: str):
+    """
+    YYYY-MM-DD[ HH:MM] or relative like 12h, 7d, 2w; None for ""
+    """
+    if value == "":
+        return None
+    match = re.fullmatch(r"(\d+)([hdw])", value)
+    if match:
+        seconds = {"h": 3600, "d": 86400, "w": 7 * 86400}[match.group(2)]
+        return int(time.time()) - int(match.group(1)) * seconds
+    for fmt in ("%Y-%m-%d", "%Y-%m-%d %H:%M"):
+        try:
+            return int(time.mktime(time.strptime(value, fmt)))
+        except ValueError:
+            pass
+    raise ValueError(f"bad time {value}, use YYYY-MM-DD or 12h/7d/2w")
+
+
+def time_arg(value: str) -> str:
+    """
+    argparse type of log --since/--until, so a bad time is a usage error like --where
+    """
+    try:
+        parse_time(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+    return value
+
+
+@register_cmd
+class GitIndexCmd(CmdBase):
+    cmd = "index"
+    description = "index commits of all repositories into .repm/index.sqlite for the log cmd, incremental"
+    help = description
+    workload = "disk"
+    # history is shared, indexed once by the main repo
+    worktrees = False
+    use_progress = False
+
+    @staticmethod
+    def run_cmd(cls, rebuild: bool = False):
+        global_conf, need_exec = runner.load_config(cls.worktrees)
+        jobs = global_conf.get("jobs", None)
+        if not isinstance(jobs, int):
+            jobs = cls.jobs_num
+        CommitIndex(runner.base_path).update(runner.select_by_where(need_exec), jobs, rebuild)
+
+    def run(self, rebuild: bool = False):
+        """
+        :param rebuild : drop index and walk all history again
+        """
+        return 0, "", ""
+
+
+@register_cmd
+class GitLogCmd(CmdBase):
+    cmd = "log"
+    description = "query commits of all repositories from index, run index first"
+    help = description
+    use_where = False
+    use_progress = False
+
+    @staticmethod
+    def run_cmd(cls, since: str = "", until: str = "", author: str = "", path: str = "", repo: str = "",
+                limit: int = 50):
+        index = CommitIndex(runner.base_path)
+        if not index.exists():
+            cmd_logger.error("no index, run index first")
+            return
+        begin = time.time()
+        rows = index.query(parse_time(since), parse_time(until), author, path, repo, limit)
+        for date, repo_name, sha, author_name, subject in rows:
+            date_str = time.strftime("%Y-%m-%d %H:%M", time.localtime(date))
+            print(f"{date_str} | {repo_name} | {sha[:10]} | {author_name} | {subject}")
+        cmd_logger.info(f"log | {len(rows)} commits | {(time.time() - begin) * 1000:.1f}ms")
+
+    def run(self, since: time_arg = "", until: time_arg = "", author: str = "", path: str = "", repo: str = "",
+            limit: int = 50):
+        """
+        :param since : commits after, YYYY-MM-DD or 12h/7d/2w ago
+        :param until : commits before, same format as since
+        :param author : author name or email contains
+        :param path : touched this file or any file under this dir
+        :param repo : repo path contains
+        :param limit : max commits to print, newest first
+        """
+        return 0, "", ""
+
+
+@register_cmd
+class GitLockCmd(CmdBase):
+    cmd = "lock"
+    description = "write HEAD sha, branch and submodule shas of all repositories into a lock file"
+    help = description
+    workload = "disk"
+    # worktrees are created again by clone from config
+    worktrees = False
+    use_progress = False
+    LOCK_FILE_NAME = "Repositories.lock.yaml"
+
+    @staticmethod
+    def run_cmd(cls, file: str = LOCK_FILE_NAME):
+        begin = time.time()
+        global_conf, need_exec = runner.load_config(cls.worktrees)
+        need_exec = runner.select_by_where(need_exec)
+
+        def lock_one(item):
+            path = item["workspace"].base_path / item["local"]
+            head = read_head_sha(path)
+            if head is None:
+                return None
+            branch = read_head_branch(path)
+            return {
+                "remote": item.get("remote", None),
+                "head": head,
+                "branch": None if branch == "HEAD" else branch,
+                "submodules": read_submodule_shas(path),
+            }
+
+        # only file reads, threads are enough
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(32, multiprocessing.cpu_count() * 4)) as executor:
+            locks = list(executor.map(lock_one, need_exec))
+        repos = {}
+        for item, lock in zip(need_exec, locks):
+            if lock is None:
+                cmd_logger.info(f"not cloned, not locked | {item['name']}")
+                continue
+            repos[item["workspace"].display_path(item["local"])] = lock
+        lock_file = runner.base_path / file
+        with open(lock_file, "w") as f:
+            yaml.safe_dump({"repos": repos}, f, sort_keys=True)
+        cmd_logger.info(f"lock | {len(repos)} repos -> {lock_file} | {time.time() - begin:.2f}s")
+
+    def run(self, file: str = LOCK_FILE_NAME):
+        """
+        :param file : lock file path, relative to the top config dir
+        """
+        return 0, "", ""
+
+
+@register_cmd
+class GitRestoreCmd(CmdBase):
+    cmd = "restore"
+    description = "checkout all repositories to the shas in lock file, fetch only needed commits"
+    help = description
+    workload = "network"
+    # lock file has only main repos
+    worktrees = False
+
+    @staticmethod
+    def run_cmd(cls, file: str = GitLockCmd.LOCK_FILE_NAME, force: bool = False):
+        with open(runner.base_path / file) as f:
+            repos = (yaml.safe_load(f) or {}).get("repos", None) or {}
+        global_conf, need_exec = runner.load_config(cls.worktrees)
+        locked = []
+        for item in need_exec:
+            lock = repos.get(item["workspace"].display_path(item["local"]), None)
+            if lock is None:
+                cmd_logger.info(f"not in lock file | {item['name']}")
+                continue
+            item["lock"] = lock
+            locked.append(item)
+        jobs = runner.make_jobs(cls, global_conf)
+        return runner.execute(cls, locked, jobs, file=file, force=force)
+
+    def git(self, *args, cwd=None):
+        return run_command(["git"] + list(args), cwd=cwd or self.repo_path)
+
+    def fetch_sha(self, sha: str, shallow: bool, cwd=None):
+        """
+        fetch only the commit if server allows(uploadpack.allowReachableSHA1InWant), else fetch all
+        """
+        if self.git("cat-file", "-e", f"{sha}^{{commit}}", cwd=cwd)[0] == 0:
+            return 0, "", ""
+        depth = ["--depth", "1"] if shallow else []
+        ret, stdout, stderr = self.git("fetch", "--no-tags", *depth, "origin", sha, cwd=cwd)
+        if ret == 0:
+            return ret, stdout, stderr
+        cmd_logger.info(f"fetch by sha not allowed, fetch all | {self.name} | {cwd or ''}")
+        return self.git("fetch", "origin", cwd=cwd)
+
+    @staticmethod
+    def checkout_args(sha: str, branch: str) -> list:
+        if branch:
+            return ["checkout", "-q", "--force", "-B", branch, sha]
+        return ["checkout", "-q", "--force", "--detach", sha]
+
+    def checkout_fresh(self, remote: str, sha: str, branch: str):
+        """
+        init an empty dir, fetch the sha with depth 1 and check it out, the branch tracks origin like a clone
+        """
+        self.repo_path.mkdir(parents=True)
+        for args in (("init", "-q"), ("remote", "add", "origin", remote)):
+            ret, stdout, stderr = self.git(*args)
+            if ret != 0:
+                return ret, stdout, stderr
+        ret, stdout, stderr = self.fetch_sha(sha, True)
+        if ret != 0:
+            return ret, stdout, stderr
+        ret, stdout, stderr = self.git(*self.checkout_args(sha, branch))
+        if ret != 0 or not branch:
+            return ret, stdout, stderr
+        # fetch by sha writes no remote ref, start it at the locked sha, the next pull/fetch moves it
+        remote_ref = f"refs/remotes/origin/{branch}"
+        if self.git("rev-parse", "--verify", "-q", remote_ref)[0] != 0:
+            ret, stdout, stderr = self.git("update-ref", remote_ref, sha)
+            if ret != 0:
+                return ret, stdout, stderr
+        return self.git("branch", "-q", f"--set-upstream-to=origin/{branch}", branch)
+
+    def unmerged_refs(self, sha: str, branch: str) -> list:
+        """
+        refs whose commits checkout would drop: the locked branch reset by -B and a detached HEAD left behind
+        a ref not an ancestor of sha is still safe to move if all its commits are on a remote ref, e.g. older lock
+        """
+        refs = []
+        if branch and self.git("rev-parse", "--verify", "-q", f"refs/heads/{branch}")[0] == 0:
+            refs.append(f"refs/heads/{branch}")
+        if self.git("symbolic-ref", "-q", "HEAD")[0] != 0:
+            refs.append("HEAD")
+        unmerged = []
+        for ref in refs:
+            if self.git("merge-base", "--is-ancestor", ref, sha)[0] == 0:
+                continue
+            ret, stdout, _ = self.git("rev-list", "-n", "1", ref, "--not", sha, "--remotes")
+            if ret != 0 or stdout.strip() != "":
+                unmerged.append(ref)
+        return unmerged
+
+    def run(self, file: str = GitLockCmd.LOCK_FILE_NAME, force: bool = False):
+        """
+        :param file : lock file path, relative to the top config dir
+        :param force : discard local changes and local commits not in the locked sha
+        """
+        lock = self.curr_conf["lock"]
+        sha = lock["head"]
+        remote = self.value_or_default("remote", None) or lock["remote"]
+        fresh = not self.repo_path.exists()
+        if not fresh:
+            if read_head_sha(self.repo_path) == sha and read_submodule_shas(self.repo_path) == lock["submodules"]:
+                cmd_logger.debug("already at lock | %s", self.name)
+                return 0, "", ""
+            if not force and self.git("status", "--porcelain", "--untracked-files=no")[1].strip() != "":
+                cmd_logger.error(f"fail | {self.name} | has local changes, add --force to discard")
+                return -1, "", "dirty"
+
+        cmd_logger.info(f"restore | {self.name} | {lock['branch'] or 'detached'} {sha[:10]}")
+        if fresh:
+            ret, stdout, stderr = self.checkout_fresh(remote, sha, lock["branch"])
+            if ret != 0:
+                # half built repo would be skipped by clone as existing
+                shutil.rmtree(self.repo_path, ignore_errors=True)
+                return ret, stdout, stderr
+        else:
+            ret, stdout, stderr = self.fetch_sha(sha, False)
+            if ret != 0:
+                return ret, stdout, stderr
+            # same rule as update of shallow repos: never drop local commits
+            unmerged = [] if force else self.unmerged_refs(sha, lock["branch"])
+            if len(unmerged) > 0:
+                cmd_logger.error(f"fail | {self.name} | {', '.join(unmerged)} has commits not in lock, "
+                                 f"add --force to discard")
+                return -1, "", "unmerged"
+            ret, stdout, stderr = self.git(*self.checkout_args(sha, lock["branch"]))
+            if ret != 0:
+                return ret, stdout, stderr
+        if len(lock["submodules"]) == 0:
+            return 0, "", ""
+
+        depth = ["--depth", "1"] if fresh else []
+        ret, stdout, stderr = self.git("submodule", "update", "--init", "--recursive", *depth)
+        if ret != 0 and fresh:
+            ret, stdout, stderr = self.git("submodule", "update", "--init", "--recursive")
+        if ret != 0:
+            return ret, stdout, stderr
+        # submodules locked at a sha different from the superproject's record
+        for sub_path, sub_sha in sorted(lock["submodules"].items()):
+            sub_dir = self.repo_path / sub_path
+            if read_head_sha(sub_dir) == sub_sha:
+                continue
+            ret, stdout, stderr = self.fetch_sha(sub_sha, False, cwd=sub_dir)
+            if ret == 0:
+                ret, stdout, stderr = self.git("checkout", "-q", "--force", "--detach", sub_sha, cwd=sub_dir)
+            if ret != 0:
+                return ret, stdout, stderr
+        return 0, "", ""
+
+
 if __name__ == '__main__':
+    # plugins import repm, make them share this module instead of loading a second copy
+    sys.modules.setdefault("repm", sys.modules[__name__])
     cmd_main()
     pass
@@ -0,0 +1,77 @@
+import os
+import pathlib
+import subprocess
+import sys
+import tempfile
+
+import pytest
+import yaml
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+# repm creates its runner on import and needs a config file in cwd or its parents
+_import_dir = tempfile.mkdtemp(prefix="repm-test-")
+(pathlib.Path(_import_dir) / "Repositories.yaml").write_text("all_repos: {}\n")
+_cwd = os.getcwd()
+os.chdir(_import_dir)
+import repm  # noqa: E402
+
+os.chdir(_cwd)
+
+
+@pytest.fixture
+def workspace(tmp_path, monkeypatch):
+    """
+    write config into tmp_path and return a fresh runner working there
+    """
+
+    def make(conf: dict) -> repm.GitCmdRunner:
+        (tmp_path / repm.GitCmdRunner.CONFIG_FILE_NAME).write_text(yaml.safe_dump(conf))
+        monkeypatch.chdir(tmp_path)
+        runner = repm.GitCmdRunner()
+        runner.progress_mode = "off"
+        monkeypatch.setattr(repm, "runner", runner)
+        return runner
+
+    return make
+
+
+def run_git(*args, cwd=None) -> str:
+    return subprocess.run(["git", *args], cwd=cwd, check=True, capture_output=True, text=True).stdout.strip()
+
+
+class Remote:
+    """
+    bare repo with a work clone to push new commits from
+    """
+
+    def __init__(self, path: pathlib.Path):
+        self.bare = path / "remote.git"
+        self.work = path / "remote_work"
+        run_git("init", "-q", "--bare", "-b", "main", str(self.bare))
+        run_git("clone", "-q", str(self.bare), str(self.work))
+        run_git("checkout", "-q", "-b", "main", cwd=self.work)
+        self.commit("init")
+
+    @property
+    def url(self) -> str:
+        # file:// so that --depth works
+        return self.bare.as_uri()
+
+    def commit(self, message: str, branch: str = "main") -> str:
+        run_git("checkout", "-q", "-B", branch, cwd=self.work)
+        with open(self.work / f"{branch.replace('/', '-')}.txt", "a") as f:
+            f.write(message + "\n")
+        run_git("add", ".", cwd=self.work)
+        run_git("commit", "-q", "-m", message, cwd=self.work)
+        run_git("push", "-q", "origin", branch, cwd=self.work)
+        return run_git("rev-parse", "HEAD", cwd=self.work)
+
+
+@pytest.fixture
+def remote(tmp_path_factory, monkeypatch):
+    for key in ("GIT_AUTHOR_NAME", "GIT_COMMITTER_NAME"):
+        monkeypatch.setenv(key, "repm test")
+    for key in ("GIT_AUTHOR_EMAIL", "GIT_COMMITTER_EMAIL"):
+        monkeypatch.setenv(key, "repm@test")
+    return Remote(tmp_path_factory.mktemp("remote"))
@@ -0,0 +1,67 @@
+"""
+stand-in git for scheduler tests, put on PATH as "git" by test_scheduler
+behaviour of each repo is read from $REPM_FAKE_GIT_DIR/scenario.json:
+{"default": {...}, "repos": {name: {...}}}, keys: latency, hang, output, stderr, exit,
+transient(first n calls fail with transient_error)
+every call appends start/end events to events.log, used to measure concurrency
+"""
+import json
+import os
+import pathlib
+import sys
+import time
+
+state = pathlib.Path(os.environ["REPM_FAKE_GIT_DIR"])
+args = sys.argv[1:]
+cwd = os.getcwd()
+while len(args) >= 2 and args[0] in ("-C", "-c"):
+    if args[0] == "-C":
+        cwd = args[1]
+    args = args[2:]
+if len(args) > 0 and args[0] == "clone":
+    # clone creates the repo like the real one
+    target = pathlib.Path(cwd) / args[-1]
+    for sub in ("objects", "refs/heads"):
+        (target / ".git" / sub).mkdir(parents=True, exist_ok=True)
+    (target / ".git" / "HEAD").write_text("ref: refs/heads/main\n")
+    cwd = str(target)
+repo = os.path.basename(cwd.rstrip("/"))
+with open(state / "scenario.json") as f:
+    scenario = json.load(f)
+conf = dict(scenario.get("default", {}))
+conf.update(scenario.get("repos", {}).get(repo, {}))
+
+
+def event(kind):
+    with open(state / "events.log", "a") as f:
+        f.write(f"{kind} {time.time():.6f} {repo} {os.getpid()} {args[0] if args else ''}\n")
+
+
+with open(state / "attempts" / repo, "ab") as f:
+    f.write(b".")
+attempt = os.path.getsize(state / "attempts" / repo)
+event("start")
+code = 0
+try:
+    latency = conf.get("latency", 0)
+    if attempt <= conf.get("transient", 0):
+        time.sleep(latency)
+        sys.stderr.write(conf.get("transient_error",
+                                  "fatal: unable to access: The requested URL returned error: 429") + "\n")
+        code = 128
+    else:
+        if conf.get("hang", 0):
+            time.sleep(conf["hang"])
+        output = conf.get("output", [])
+        for line in output:
+            sys.stdout.write(line + "\n")
+            sys.stdout.flush()
+            time.sleep(latency / len(output))
+        if len(output) == 0:
+            time.sleep(latency)
+        if conf.get("stderr", ""):
+            sys.stderr.write(conf["stderr"] + "\n")
+        code = conf.get("exit", 0)
+finally:
+    event("end")
+sys.exit(code)
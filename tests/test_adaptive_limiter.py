@@ -0,0 +1,33 @@
+import repm
+
+
+def make_limiter(monkeypatch, limit: int):
+    limiter = repm.AdaptiveLimiter("network")
+    monkeypatch.setattr(limiter, "overloaded", lambda: "")
+    limiter.limit = limit
+    limiter.backoff_left = 0
+    return limiter
+
+
+def test_small_window_waits_for_min_window(monkeypatch):
+    limiter = make_limiter(monkeypatch, 1)
+    for _ in range(repm.AdaptiveLimiter.MIN_WINDOW - 1):
+        limiter.on_done(True, "")
+    assert limiter.limit == 1
+    limiter.on_done(True, "")
+    assert limiter.limit == 2
+
+
+def test_transient_error_halves_once_per_window(monkeypatch):
+    limiter = make_limiter(monkeypatch, 8)
+    limiter.on_done(False, "error: RPC failed; HTTP 429")
+    assert limiter.limit == 4
+    limiter.on_done(False, "fatal: the remote end hung up unexpectedly")
+    assert limiter.limit == 4
+
+
+def test_other_errors_count_as_done(monkeypatch):
+    limiter = make_limiter(monkeypatch, 2)
+    for _ in range(repm.AdaptiveLimiter.MIN_WINDOW):
+        limiter.on_done(False, "fatal: not a git repository")
+    assert limiter.limit == 3
@@ -0,0 +1,37 @@
+import repm
+from conftest import run_git
+
+
+def exec_logs(monkeypatch):
+    logs = []
+    monkeypatch.setattr(repm.cmd_logger, "debug", lambda msg, *args: logs.append(msg % args))
+    return logs
+
+
+def run_cached(runner, need_exec, cmd):
+    success, fail, _ = runner.execute(repm.GitAnyCmd, need_exec, 1, cmd=cmd, cache=True)
+    return (success + fail)[0]
+
+
+def test_hit_logs_cached_output(workspace, remote, monkeypatch):
+    runner = workspace({"all_repos": {"r": {"a": {"remote": remote.url}}}})
+    _, need_exec = runner.load_config()
+    runner.execute(repm.GitCloneCmd, need_exec, 1)
+    logs = exec_logs(monkeypatch)
+    assert run_cached(runner, need_exec, "echo replayed")["cmd_cached"] is False
+    assert run_cached(runner, need_exec, "echo replayed")["cmd_cached"] is True
+    replayed = [log for log in logs if log.startswith("exec | ") and "replayed" in log.split("\n", 1)[1]]
+    assert len(replayed) == 2
+
+
+def test_fingerprint_skips_rename_source(remote, monkeypatch):
+    path = remote.work
+    run_git("mv", "main.txt", "moved.txt", cwd=path)
+    stat_paths = []
+    lstat = repm.os.lstat
+    monkeypatch.setattr(repm.os, "lstat", lambda p: stat_paths.append(p.name) or lstat(p))
+    before = repm.worktree_fingerprint(path)
+    # the source path after a rename record has no status prefix, must not be cut into a path
+    assert stat_paths == ["moved.txt"]
+    (path / "moved.txt").write_text("changed, longer than before\n")
+    assert repm.worktree_fingerprint(path) != before
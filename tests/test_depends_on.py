@@ -0,0 +1,83 @@
+import time
+
+import repm
+
+
+class ScriptedCmd(repm.CmdBase):
+    """
+    no git, sleep / fail as set in each repo's config
+    """
+    cmd = "scripted"
+
+    def run(self):
+        time.sleep(self.value_or_default("sleep", 0))
+        if self.value_or_default("fail", False):
+            return 1, "", "scripted fail"
+        return 0, "", ""
+
+
+def names(items):
+    return sorted(item["name"] for item in items)
+
+
+def run_scripted(workspace, repos: dict, jobs: int = 4):
+    runner = workspace({"all_repos": {"r": repos}})
+    _, need_exec = runner.load_config()
+    return runner.execute(ScriptedCmd, need_exec, jobs)
+
+
+def test_downstream_of_failed_is_skipped(workspace):
+    success, fail, skip = run_scripted(workspace, {
+        "a": {},
+        "b": {"fail": True, "depends_on": "a"},
+        "c": {"depends_on": ["b"]},
+        "d": {"depends_on": ["a"]},
+    })
+    assert names(success) == ["a", "d"]
+    assert names(fail) == ["b"]
+    assert names(skip) == ["c"]
+
+
+def test_other_dependency_succeeds_after_failure(workspace):
+    # b fails before a finishes, j is skipped then a's success must not touch it
+    success, fail, skip = run_scripted(workspace, {
+        "a": {"sleep": 0.3},
+        "b": {"fail": True},
+        "j": {"depends_on": ["a", "b"]},
+        "k": {"depends_on": ["j"]},
+    })
+    assert names(success) == ["a"]
+    assert names(fail) == ["b"]
+    assert names(skip) == ["j", "k"]
+
+
+def test_diamond_failure_skips_join_once(workspace):
+    success, fail, skip = run_scripted(workspace, {
+        "top": {},
+        "left": {"depends_on": "top", "sleep": 0.3},
+        "right": {"depends_on": "top", "fail": True},
+        "bottom": {"depends_on": ["left", "right"]},
+    })
+    assert names(success) == ["left", "top"]
+    assert names(fail) == ["right"]
+    assert names(skip) == ["bottom"]
+
+
+def test_dependency_runs_first(workspace):
+    order = []
+
+    class OrderCmd(ScriptedCmd):
+        def run(self):
+            ret = super().run()
+            order.append(self.name)
+            return ret
+
+    runner = workspace({"all_repos": {"r": {
+        "lib": {"sleep": 0.2},
+        "app": {"depends_on": "lib"},
+        "tool": {"depends_on": "r/app"},
+    }}})
+    _, need_exec = runner.load_config()
+    success, fail, skip = runner.execute(OrderCmd, need_exec, 4)
+    assert order == ["lib", "app", "tool"]
+    assert len(fail) == 0 and len(skip) == 0
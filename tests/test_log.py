@@ -0,0 +1,19 @@
+import pytest
+
+import repm
+
+
+def test_parse_time():
+    assert repm.parse_time("") is None
+    assert repm.parse_time("2w") < repm.parse_time("1d") < repm.parse_time("2h")
+    with pytest.raises(ValueError):
+        repm.parse_time("yesterday")
+
+
+@pytest.mark.parametrize("option", ["--since", "--until"])
+def test_bad_time_is_usage_error(workspace, capsys, option):
+    workspace({"all_repos": {}})
+    with pytest.raises(SystemExit) as e:
+        repm.cmd_main(["log", option, "yesterday"])
+    assert e.value.code == 2
+    assert "bad time yesterday" in capsys.readouterr().err
@@ -0,0 +1,38 @@
+import repm
+
+PLUGIN = '''
+import pathlib
+
+import repm
+
+with open(pathlib.Path(__file__).with_suffix(".count"), "a") as f:
+    f.write("x")
+
+
+class HelloCmd(repm.CmdBase):
+    cmd = "hello_plugin"
+    help = "say hello"
+
+    def run(self):
+        return 0, "hello", ""
+'''
+
+
+def test_plugin_file_imported_once(workspace, tmp_path):
+    workspace({"all_repos": {}})
+    plugin_dir = tmp_path / repm.CmdRegistry.PLUGIN_DIR
+    plugin_dir.mkdir(parents=True)
+    (plugin_dir / "hello.py").write_text(PLUGIN)
+    count = plugin_dir / "hello.count"
+    # cache miss: describe imports the file, load reuses its class
+    registry = repm.CmdRegistry()
+    registry.discover_plugins()
+    cls = registry.load("hello_plugin")
+    assert cls.help == "say hello"
+    assert count.read_text() == "x"
+    # cache hit: help from cache, file imported only by load
+    registry = repm.CmdRegistry()
+    registry.discover_plugins()
+    assert count.read_text() == "x"
+    assert registry.load("hello_plugin").cmd == "hello_plugin"
+    assert count.read_text() == "xx"
@@ -0,0 +1,37 @@
+import io
+import logging
+import threading
+
+import pytest
+
+import repm
+
+
+def test_log_line_written_under_progress_lock(monkeypatch):
+    progress = repm.Progress([], mode="live")
+    monkeypatch.setattr(repm.runner, "progress", progress)
+    held = []
+
+    class Stream(io.StringIO):
+        def write(self, s):
+            held.append(progress.lock.locked())
+            return super().write(s)
+
+    handler = repm.ProgressStreamHandler(Stream())
+    handler.emit(logging.LogRecord("cmd", logging.INFO, __file__, 0, "hello", None, None))
+    assert len(held) > 0 and all(held)
+
+
+def test_interrupt_stops_progress(workspace, monkeypatch):
+    runner = workspace({"all_repos": {"r": {"a": {}}}})
+    runner.progress_mode = "live"
+    _, need_exec = runner.load_config()
+
+    def interrupted(*args, **kwargs):
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(repm.GitCmdRunner, "cmd_execute_worker", staticmethod(interrupted))
+    with pytest.raises(KeyboardInterrupt):
+        runner.execute(repm.GitStatusCmd, need_exec, 1)
+    assert runner.progress is None
+    assert not any(thread.name == "progress" for thread in threading.enumerate())
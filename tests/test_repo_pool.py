@@ -0,0 +1,63 @@
+import pytest
+
+import repm
+from conftest import run_git
+
+
+@pytest.fixture
+def repo_path(tmp_path):
+    run_git("init", "-q", str(tmp_path / "a"))
+    return tmp_path / "a"
+
+
+def test_released_handle_is_closed(repo_path):
+    pool = repm.RepoPool()
+    first = pool.acquire(repo_path)
+    assert pool.acquire(repo_path) is first
+    pool.release(repo_path)
+    assert len(pool.handles) == 1
+    pool.release(repo_path)
+    assert len(pool.handles) == 0
+    assert pool.closed == 1
+
+
+def test_pending_path_stays_open(repo_path):
+    pool = repm.RepoPool()
+    pool.expect([repo_path, repo_path])
+    first = pool.acquire(repo_path)
+    pool.finish(repo_path)
+    pool.release(repo_path)
+    assert pool.acquire(repo_path) is first
+    assert pool.reused == 1
+    pool.finish(repo_path)
+    pool.release(repo_path)
+    assert len(pool.handles) == 0
+
+
+class OpenCmd(repm.CmdBase):
+    cmd = "open"
+
+    def run(self):
+        assert self.repository is not None
+        return 0, "", ""
+
+
+def test_execute_leaves_no_handles(workspace, monkeypatch):
+    runner = workspace({"all_repos": {"r": {name: {} for name in ("a", "b", "c")}}})
+    for name in ("a", "b", "c"):
+        run_git("init", "-q", str(runner.base_path / "r" / name))
+    _, need_exec = runner.load_config()
+    success, _, _ = runner.execute(OpenCmd, need_exec, 2)
+    assert len(success) == 3
+    assert len(repm.repo_pool.handles) == 0
+    assert len(repm.repo_pool.pending) == 0
+
+    # handles are closed even if the run is aborted
+    def abort(*args):
+        raise KeyboardInterrupt()
+
+    monkeypatch.setattr(repm.Progress, "task_end", abort)
+    with pytest.raises(KeyboardInterrupt):
+        runner.execute(OpenCmd, need_exec, 2)
+    assert len(repm.repo_pool.handles) == 0
+    assert len(repm.repo_pool.pending) == 0
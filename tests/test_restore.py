@@ -0,0 +1,65 @@
+import shutil
+
+import repm
+from conftest import run_git
+
+
+def clone_and_lock(workspace, remote):
+    runner = workspace({"all_repos": {"r": {"a": {"remote": remote.url}}}})
+    _, need_exec = runner.load_config()
+    _, fail, _ = runner.execute(repm.GitCloneCmd, need_exec, 1)
+    assert len(fail) == 0
+    path = runner.base_path / "r" / "a"
+    repm.GitLockCmd.run_cmd(repm.GitLockCmd)
+    return runner, need_exec, path
+
+
+def restore(force: bool = False):
+    return repm.GitRestoreCmd.run_cmd(repm.GitRestoreCmd, force=force)
+
+
+def test_restore_keeps_unpushed_commits(workspace, remote):
+    runner, _, path = clone_and_lock(workspace, remote)
+    locked = run_git("rev-parse", "HEAD", cwd=path)
+    run_git("commit", "-q", "--allow-empty", "-m", "unpushed work", cwd=path)
+    local = run_git("rev-parse", "HEAD", cwd=path)
+    _, fail, _ = restore()
+    assert len(fail) == 1
+    assert run_git("rev-parse", "HEAD", cwd=path) == local
+    _, fail, _ = restore(force=True)
+    assert len(fail) == 0
+    assert run_git("rev-parse", "HEAD", cwd=path) == locked
+
+
+def test_restore_to_older_sha(workspace, remote):
+    runner, need_exec, path = clone_and_lock(workspace, remote)
+    locked = run_git("rev-parse", "HEAD", cwd=path)
+    remote.commit("second")
+    runner.execute(repm.GitUpdateCmd, need_exec, 1)
+    # branch moves back, its newer commits are on origin so nothing is lost
+    _, fail, _ = restore()
+    assert len(fail) == 0
+    assert run_git("rev-parse", "HEAD", cwd=path) == locked
+
+
+def test_fresh_restore_tracks_remote(workspace, remote):
+    runner, need_exec, path = clone_and_lock(workspace, remote)
+    locked = run_git("rev-parse", "HEAD", cwd=path)
+    shutil.rmtree(path)
+    _, fail, _ = restore()
+    assert len(fail) == 0
+    assert run_git("rev-parse", "HEAD", cwd=path) == locked
+    assert run_git("rev-parse", "--abbrev-ref", "@{upstream}", cwd=path) == "origin/main"
+    tip = remote.commit("second")
+    _, fail, skip = runner.execute(repm.GitUpdateCmd, need_exec, 1)
+    assert len(fail) == 0 and len(skip) == 0
+    assert run_git("rev-parse", "HEAD", cwd=path) == tip
+
+
+def test_failed_fresh_restore_removes_dir(workspace, remote, tmp_path):
+    runner, _, path = clone_and_lock(workspace, remote)
+    shutil.rmtree(path)
+    workspace({"all_repos": {"r": {"a": {"remote": str(tmp_path / "missing.git")}}}})
+    _, fail, _ = restore()
+    assert len(fail) == 1
+    assert not path.exists()
@@ -0,0 +1,169 @@
+"""
+drive GitCmdRunner through hundreds of fake repos with a stand-in git on PATH(fake_git.py),
+assert on makespan, concurrency and failure handling
+"""
+import collections
+import json
+import pathlib
+import sys
+import time
+
+import pytest
+
+import repm
+
+FAKE_GIT = pathlib.Path(__file__).resolve().parent / "fake_git.py"
+
+
+class Simulation:
+    def __init__(self, runner, state_dir: pathlib.Path):
+        self.runner = runner
+        self.state_dir = state_dir
+        self.makespan = 0
+
+    def run(self, cls, jobs=None, **kwargs):
+        global_conf, need_exec = self.runner.load_config()
+        if jobs is None:
+            jobs = self.runner.make_jobs(cls, global_conf)
+        begin = time.time()
+        success, fail, skip = self.runner.execute(cls, need_exec, jobs, **kwargs)
+        self.makespan = time.time() - begin
+        return sorted(item["name"] for item in success), sorted(item["name"] for item in fail), \
+            sorted(item["name"] for item in skip)
+
+    def events(self):
+        """
+        :return: peak concurrent git processes, {repo: git calls}
+        """
+        points = []
+        calls = collections.Counter()
+        events_file = self.state_dir / "events.log"
+        if events_file.is_file():
+            for line in events_file.read_text().splitlines():
+                kind, ts, repo_name = line.split()[:3]
+                points.append((float(ts), 1 if kind == "start" else -1))
+                if kind == "start":
+                    calls[repo_name] += 1
+        peak = curr = 0
+        for _, delta in sorted(points):
+            curr += delta
+            peak = max(peak, curr)
+        return peak, calls
+
+
+@pytest.fixture
+def simulate(workspace, tmp_path_factory, monkeypatch):
+    """
+    simulate(repos, scenario, global_config, depends_on, cloned) -> Simulation
+    """
+
+    def make(repos: int, scenario: dict = None, global_config: dict = None, depends_on: dict = None,
+             cloned: bool = True) -> Simulation:
+        sim_dir = tmp_path_factory.mktemp("sim")
+        state_dir = sim_dir / "state"
+        (state_dir / "attempts").mkdir(parents=True)
+        (state_dir / "scenario.json").write_text(json.dumps(scenario or {}))
+        bin_dir = sim_dir / "bin"
+        bin_dir.mkdir()
+        (bin_dir / "git").write_text(f'#!/bin/sh\nexec "{sys.executable}" "{FAKE_GIT}" "$@"\n')
+        (bin_dir / "git").chmod(0o755)
+        monkeypatch.setenv("PATH", f"{bin_dir}:{repm.os.environ['PATH']}")
+        monkeypatch.setenv("REPM_FAKE_GIT_DIR", str(state_dir))
+
+        names = [f"r{i}" for i in range(repos)]
+        all_repos = {name: {"remote": f"https://sim.example.com/{name}.git"} for name in names}
+        for name, deps in (depends_on or {}).items():
+            all_repos[name]["depends_on"] = deps
+        runner = workspace({"global_config": global_config or {"jobs": 16}, "all_repos": {"sim": all_repos}})
+        if cloned:
+            for name in names:
+                git_dir = runner.base_path / "sim" / name / ".git"
+                for sub in ("objects", "refs/heads"):
+                    (git_dir / sub).mkdir(parents=True)
+                (git_dir / "HEAD").write_text("ref: refs/heads/main\n")
+        return Simulation(runner, state_dir)
+
+    return make
+
+
+def test_makespan_and_concurrency(simulate):
+    sim = simulate(200, {"default": {"latency": 0.2}}, {"jobs": 32})
+    success, fail, skip = sim.run(repm.GitUpdateCmd)
+    peak, calls = sim.events()
+    assert len(success) == 200 and fail == [] and skip == []
+    assert sum(calls.values()) == 200
+    assert 8 <= peak <= 32
+    # serial is over 40s, starting the fake git costs cpu so leave room on small machines
+    assert sim.makespan < 40 / 3
+
+
+def test_clone_through_fake_git(simulate):
+    sim = simulate(50, {"default": {"latency": 0.02}}, {"jobs": 16}, cloned=False)
+    success, fail, _ = sim.run(repm.GitCloneCmd)
+    assert len(success) == 50 and fail == []
+    assert all((sim.runner.base_path / "sim" / name / ".git" / "HEAD").is_file() for name in success)
+
+
+def test_failed_repos_are_reported(simulate):
+    failing = {f"r{i}": {"exit": 1, "stderr": "fatal: simulated failure"} for i in range(0, 100, 20)}
+    sim = simulate(100, {"default": {"latency": 0.01}, "repos": failing})
+    success, fail, _ = sim.run(repm.GitUpdateCmd)
+    assert fail == sorted(failing)
+    assert len(success) == 95
+
+
+def test_transient_errors_are_retried(simulate):
+    flaky = {f"r{i}": {"transient": 2} for i in range(10)}
+    sim = simulate(50, {"default": {"latency": 0.01}, "repos": flaky}, {"jobs": 8, "retries": 2})
+    success, fail, _ = sim.run(repm.GitUpdateCmd)
+    _, calls = sim.events()
+    assert fail == [] and len(success) == 50
+    assert all(calls[name] == 3 for name in flaky)
+    assert calls["r10"] == 1
+
+
+def test_transient_errors_fail_without_retries(simulate):
+    flaky = {f"r{i}": {"transient": 1} for i in range(10)}
+    sim = simulate(50, {"default": {"latency": 0.01}, "repos": flaky})
+    _, fail, _ = sim.run(repm.GitUpdateCmd)
+    assert fail == sorted(flaky)
+
+
+def test_partial_output_then_early_eof(simulate):
+    partial = {"r3": {"output": ["Receiving objects:  50%"], "exit": 128, "stderr": "fatal: early EOF"}}
+    sim = simulate(20, {"default": {"latency": 0.01}, "repos": partial}, {"jobs": 4, "retries": 1})
+    _, fail, _ = sim.run(repm.GitUpdateCmd)
+    _, calls = sim.events()
+    assert fail == ["r3"]
+    assert calls["r3"] == 2
+
+
+def test_timeout_kills_hung_git(simulate):
+    hung = {"r1": {"hang": 30}, "r7": {"hang": 30}}
+    sim = simulate(40, {"default": {"latency": 0.01}, "repos": hung}, {"jobs": 8, "timeout": 1})
+    success, fail, _ = sim.run(repm.GitUpdateCmd)
+    assert fail == ["r1", "r7"]
+    assert len(success) == 38
+    assert sim.makespan < 10
+
+
+def test_failure_in_large_dag(simulate):
+    # chains of 10, r5 fails early; join waits on a failed chain and a slow chain that succeeds later
+    depends_on = {f"r{i}": [f"r{i - 1}"] for i in range(200) if i % 10 != 0}
+    depends_on["r200"] = ["r9", "r19"]
+    repos = {"r5": {"exit": 1}, "r19": {"latency": 0.5}}
+    sim = simulate(201, {"default": {"latency": 0.01}, "repos": repos}, {"jobs": 16}, depends_on=depends_on)
+    success, fail, skip = sim.run(repm.GitUpdateCmd)
+    assert fail == ["r5"]
+    assert skip == ["r200", "r6", "r7", "r8", "r9"]
+    assert len(success) == 195
+
+
+def test_adaptive_jobs_stay_in_range(simulate):
+    sim = simulate(200, {"default": {"latency": 0.02}}, {"jobs": "auto"})
+    limiter = repm.AdaptiveLimiter(repm.GitUpdateCmd.workload)
+    success, fail, _ = sim.run(repm.GitUpdateCmd, jobs=limiter)
+    peak, _ = sim.events()
+    assert len(success) == 200 and fail == []
+    assert peak <= limiter.upper
+    assert limiter.lower <= limiter.limit <= limiter.upper
@@ -0,0 +1,42 @@
+import repm
+from conftest import run_git
+
+
+def clone(workspace, remote, **repo_conf):
+    runner = workspace({"all_repos": {"r": {"a": {"remote": remote.url, "depth": 1, **repo_conf}}}})
+    _, need_exec = runner.load_config()
+    _, fail, _ = runner.execute(repm.GitCloneCmd, need_exec, 1)
+    assert len(fail) == 0
+    return runner, need_exec, runner.base_path / "r" / "a"
+
+
+def test_shallow_update_fast_forwards(workspace, remote):
+    remote.commit("second")
+    runner, need_exec, path = clone(workspace, remote)
+    tip = remote.commit("third")
+    _, fail, _ = runner.execute(repm.GitUpdateCmd, need_exec, 1)
+    assert len(fail) == 0
+    assert run_git("rev-parse", "HEAD", cwd=path) == tip
+    assert run_git("rev-parse", "--is-shallow-repository", cwd=path) == "true"
+
+
+def test_shallow_update_keeps_local_commits(workspace, remote):
+    runner, need_exec, path = clone(workspace, remote)
+    (path / "local.txt").write_text("local\n")
+    run_git("add", ".", cwd=path)
+    run_git("commit", "-q", "-m", "local unpushed work", cwd=path)
+    local = run_git("rev-parse", "HEAD", cwd=path)
+    remote.commit("upstream")
+    # merge may succeed or refuse divergent branches, never drop the local commit
+    runner.execute(repm.GitUpdateCmd, need_exec, 1)
+    run_git("merge-base", "--is-ancestor", local, "HEAD", cwd=path)
+
+
+def test_prefetched_shallow_update(workspace, remote):
+    runner, need_exec, path = clone(workspace, remote)
+    tip = remote.commit("second")
+    _, fail, _ = runner.execute(repm.GitPrefetchCmd, need_exec, 1, interval=0)
+    assert len(fail) == 0
+    _, fail, _ = runner.execute(repm.GitUpdateCmd, need_exec, 1, prefetched=True)
+    assert len(fail) == 0
+    assert run_git("rev-parse", "HEAD", cwd=path) == tip
@@ -0,0 +1,175 @@
+"""
+ssh multiplexing with a fake ssh on PATH, and against a real local sshd when one is installed
+"""
+import getpass
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import time
+
+import pytest
+
+import repm
+from conftest import run_git
+
+FAKE_SSH = r'''
+import json, os, sys
+args = sys.argv[1:]
+with open(os.environ["FAKE_SSH_LOG"], "a") as f:
+    f.write(json.dumps(args) + "\n")
+rest = []
+i = 0
+while i < len(args):
+    if args[i] in ("-o", "-p", "-l", "-i"):
+        i += 2
+        continue
+    if args[i] == "-O":
+        sys.exit(0)
+    if args[i] == "-M" and os.environ.get("FAKE_SSH_FAIL_MASTER"):
+        sys.stderr.write("Permission denied (publickey).\n")
+        sys.exit(255)
+    if args[i].startswith("-"):
+        i += 1
+        continue
+    rest = args[i:]
+    break
+if len(rest) <= 1:
+    sys.exit(0)
+# run the remote command locally
+os.execvp("sh", ["sh", "-c", " ".join(rest[1:])])
+'''
+
+
+def test_parse_ssh_remote():
+    assert repm.parse_ssh_remote("git@example.com:group/a.git") == ("git", "example.com", None)
+    assert repm.parse_ssh_remote("example.com:/abs/a.git") == (None, "example.com", None)
+    assert repm.parse_ssh_remote("ssh://git@example.com:2222/a.git") == ("git", "example.com", 2222)
+    assert repm.parse_ssh_remote("https://example.com/a.git") is None
+    assert repm.parse_ssh_remote("/local/a.git") is None
+    assert repm.parse_ssh_remote("c:/local/a.git") is None
+
+
+@pytest.fixture
+def fake_ssh(tmp_path_factory, monkeypatch):
+    bin_dir = tmp_path_factory.mktemp("bin")
+    (bin_dir / "fake_ssh.py").write_text(FAKE_SSH)
+    (bin_dir / "ssh").write_text(f'#!/bin/sh\nexec "{sys.executable}" "{bin_dir / "fake_ssh.py"}" "$@"\n')
+    (bin_dir / "ssh").chmod(0o755)
+    log = bin_dir / "ssh.log"
+    monkeypatch.setenv("PATH", f"{bin_dir}:{os.environ['PATH']}")
+    monkeypatch.setenv("FAKE_SSH_LOG", str(log))
+
+    def calls():
+        if not log.is_file():
+            return []
+        return [json.loads(line) for line in log.read_text().splitlines()]
+
+    return calls
+
+
+def clone_over_ssh(workspace, remote, url: str, repos: int = 3, **global_config):
+    runner = workspace({"global_config": {"jobs": 4, "ssh_mux": True, **global_config},
+                        "all_repos": {"r": {f"a{i}": {"remote": url} for i in range(repos)}}})
+    _, need_exec = runner.load_config()
+    return runner.execute(repm.GitCloneCmd, need_exec, 4)
+
+
+def test_masters_are_shared_and_user_command_kept(workspace, remote, fake_ssh, monkeypatch):
+    ssh_command = 'ssh -i "/tmp/key dir/id_ed25519"'
+    monkeypatch.setenv("GIT_SSH_COMMAND", ssh_command)
+    success, fail, _ = clone_over_ssh(workspace, remote, f"localhost:{remote.bare}")
+    assert len(success) == 3 and fail == []
+    calls = fake_ssh()
+    masters = [args for args in calls if "-M" in args]
+    workers = [args for args in calls if "git-upload-pack" in " ".join(args)]
+    exits = [args for args in calls if "-O" in args]
+    assert len(masters) == 1 and len(exits) == 1 and len(workers) == 3
+    for args in calls:
+        # quoted path stays one argument
+        assert args[args.index("-i") + 1] == "/tmp/key dir/id_ed25519"
+    assert all("ControlMaster=no" in args for args in workers)
+    assert os.environ["GIT_SSH_COMMAND"] == ssh_command
+    assert repm.ssh_mux.control_dir is None
+
+
+def test_failed_master_connects_directly(workspace, remote, fake_ssh, monkeypatch, caplog):
+    monkeypatch.delenv("GIT_SSH_COMMAND", raising=False)
+    monkeypatch.setenv("FAKE_SSH_FAIL_MASTER", "1")
+    success, fail, _ = clone_over_ssh(workspace, remote, f"localhost:{remote.bare}")
+    assert len(success) == 3 and fail == []
+    assert "0/1 masters" in caplog.text
+    assert [args for args in fake_ssh() if "-O" in args] == []
+    assert "GIT_SSH_COMMAND" not in os.environ
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def sshd(tmp_path_factory):
+    """
+    sshd on 127.0.0.1 for the current user, skipped if openssh server is not installed
+    """
+    sshd_bin = shutil.which("sshd") or ("/usr/sbin/sshd" if os.path.exists("/usr/sbin/sshd") else None)
+    if sshd_bin is None or shutil.which("ssh-keygen") is None:
+        pytest.skip("sshd not installed")
+    # space in path checks quoting of GIT_SSH_COMMAND
+    ssh_dir = tmp_path_factory.mktemp("ssh") / "key dir"
+    ssh_dir.mkdir()
+    for name in ("host_key", "id_ed25519"):
+        subprocess.run(["ssh-keygen", "-q", "-t", "ed25519", "-N", "", "-f", str(ssh_dir / name)], check=True)
+    shutil.copy(ssh_dir / "id_ed25519.pub", ssh_dir / "authorized_keys")
+    port = free_port()
+    (ssh_dir / "sshd_config").write_text(
+        f"Port {port}\nListenAddress 127.0.0.1\nHostKey {ssh_dir / 'host_key'}\n"
+        f"AuthorizedKeysFile {ssh_dir / 'authorized_keys'}\nPidFile {ssh_dir / 'sshd.pid'}\n"
+        f"StrictModes no\nPasswordAuthentication no\nUsePAM no\nMaxSessions 10\n")
+    process = subprocess.Popen([sshd_bin, "-D", "-e", "-f", str(ssh_dir / "sshd_config")],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 10
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            break
+        except OSError:
+            if process.poll() is not None or time.time() > deadline:
+                process.kill()
+                pytest.skip("sshd failed to start")
+            time.sleep(0.1)
+    ssh_command = (f'ssh -i "{ssh_dir / "id_ed25519"}" -o IdentitiesOnly=yes -o BatchMode=yes '
+                   f'-o StrictHostKeyChecking=no -o UserKnownHostsFile=/dev/null')
+    yield port, ssh_command
+    process.kill()
+    process.wait()
+
+
+def test_against_local_sshd(workspace, remote, sshd, monkeypatch, caplog):
+    port, ssh_command = sshd
+    monkeypatch.setenv("GIT_SSH_COMMAND", ssh_command)
+    url = f"ssh://{getpass.getuser()}@127.0.0.1:{port}{remote.bare}"
+    # more repos than sessions, channels wait for a free one
+    success, fail, _ = clone_over_ssh(workspace, remote, url, repos=6, ssh_mux_sessions=2)
+    assert len(success) == 6 and fail == []
+    assert "1/1 masters" in caplog.text
+    assert run_git("rev-parse", "HEAD", cwd=success[0]["workspace"].base_path / success[0]["local"]) != ""
+    assert os.environ["GIT_SSH_COMMAND"] == ssh_command
+
+
+def test_failed_start_cleans_up(workspace, remote, monkeypatch):
+    monkeypatch.setenv("GIT_SSH_COMMAND", 'ssh -i "/tmp/unclosed')
+    runner = workspace({"global_config": {"ssh_mux": True},
+                        "all_repos": {"r": {"a": {"remote": f"localhost:{remote.bare}"}}}})
+    runner.progress_mode = "live"
+    _, need_exec = runner.load_config()
+    with pytest.raises(ValueError):
+        runner.execute(repm.GitCloneCmd, need_exec, 1)
+    assert runner.progress is None
+    assert len(repm.repo_pool.pending) == 0
+    assert repm.ssh_mux.control_dir is None
+    assert os.environ["GIT_SSH_COMMAND"] == 'ssh -i "/tmp/unclosed'
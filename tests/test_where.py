@@ -0,0 +1,32 @@
+import pytest
+
+import repm
+
+
+def test_parse_where():
+    assert repm.parse_where(["dirty", "branch != main"]) == [("dirty", "", None), ("branch", "!=", "main")]
+    with pytest.raises(ValueError):
+        repm.parse_where(["dirtyy"])
+
+
+def test_match_where():
+    state = {"branch": "dev", "dirty": True, "ahead": False, "behind": True}
+    assert repm.match_where(state, repm.parse_where(["dirty", "behind", "branch!=main"]))
+    assert not repm.match_where(state, repm.parse_where(["clean"]))
+    assert not repm.match_where(None, [])
+
+
+def test_bad_where_is_usage_error(workspace, capsys):
+    workspace({"all_repos": {}})
+    with pytest.raises(SystemExit) as e:
+        repm.cmd_main(["status", "--where", "dirtyy"])
+    assert e.value.code == 2
+    assert "unknown --where dirtyy" in capsys.readouterr().err
+
+
+@pytest.mark.parametrize("args", [["log", "--where", "dirty"], ["stats", "--progress", "off"]])
+def test_unused_options_are_rejected(workspace, args):
+    workspace({"all_repos": {}})
+    with pytest.raises(SystemExit) as e:
+        repm.cmd_main(args)
+    assert e.value.code == 2
@@ -0,0 +1,67 @@
+import repm
+from conftest import run_git
+
+
+def worktree_list(path) -> str:
+    return run_git("worktree", "list", "--porcelain", cwd=path)
+
+
+def clone(runner):
+    _, need_exec = runner.load_config()
+    _, fail, _ = runner.execute(repm.GitCloneCmd, need_exec, 4)
+    assert fail == []
+    return need_exec
+
+
+def test_clone_and_update_worktrees(workspace, remote):
+    remote.commit("rel", branch="release")
+    runner = workspace({"all_repos": {"r": {"a": {"remote": remote.url, "worktrees": ["release"]}}}})
+    need_exec = clone(runner)
+    assert sorted(item["name"] for item in need_exec) == ["a", "a@release"]
+    worktree = runner.base_path / "r" / "a@release"
+    assert run_git("branch", "--show-current", cwd=worktree) == "release"
+    assert repm.is_worktree(worktree) and not repm.is_worktree(runner.base_path / "r" / "a")
+
+    tip = remote.commit("rel2", branch="release")
+    _, fail, _ = runner.execute(repm.GitUpdateCmd, need_exec, 4)
+    assert fail == []
+    assert run_git("rev-parse", "HEAD", cwd=worktree) == tip
+
+
+def test_sync_moves_repo_with_worktrees(workspace, remote):
+    remote.commit("rel", branch="release")
+    beta = {"remote": remote.url, "worktrees": {"rel": "release"}}
+    clone(workspace({"all_repos": {"r": {"beta": beta}}}))
+
+    runner = workspace({"all_repos": {"r": {"beta": dict(beta, local="beta2")}}})
+    repm.GitSyncCmd.run_cmd(repm.GitSyncCmd, archive=True)
+    base = runner.base_path / "r"
+    assert not (base / "beta").exists() and not (base / "beta@rel").exists()
+    assert run_git("branch", "--show-current", cwd=base / "beta2@rel") == "release"
+    listed = worktree_list(base / "beta2")
+    assert "prunable" not in listed
+    assert str(base / "beta2@rel") in listed and str(base / "beta@rel") not in listed
+
+
+def test_sync_removes_worktree_with_git(workspace, remote):
+    remote.commit("rel", branch="release")
+    clone(workspace({"all_repos": {"r": {"a": {"remote": remote.url, "worktrees": ["release"]}}}}))
+    runner = workspace({"all_repos": {"r": {"a": {"remote": remote.url}}}})
+    repm.GitSyncCmd.run_cmd(repm.GitSyncCmd, archive=True)
+    assert not (runner.base_path / "r" / "a@release").exists()
+    assert not (runner.base_path / repm.GitSyncCmd.ARCHIVE_DIR).exists()
+    assert "a@release" not in worktree_list(runner.base_path / "r" / "a")
+
+
+def test_checkout_keeps_worktree_branch(workspace, remote):
+    remote.commit("rel", branch="release")
+    runner = workspace({"all_repos": {"r": {"a": {"remote": remote.url, "worktrees": ["release"]}}}})
+    need_exec = clone(runner)
+    worktree = runner.base_path / "r" / "a@release"
+    _, fail, _ = runner.execute(repm.GitCheckoutCmd, need_exec, 4, "main")
+    assert fail == []
+    assert run_git("branch", "--show-current", cwd=worktree) == "release"
+    tip = remote.commit("second")
+    _, fail, _ = runner.execute(repm.GitCheckoutCmd, need_exec, 4, "main")
+    assert fail == []
+    assert run_git("rev-parse", "HEAD", cwd=runner.base_path / "r" / "a") == tip